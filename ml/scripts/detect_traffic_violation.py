@@ -1,40 +1,85 @@
 import sys
 import json
 import os
+import re
+import threading
+
+import cv2
+import numpy as np
+
+DEFAULT_MODEL_PATH = 'ml/runs/detect/train/weights/best.pt'
+
+# In --serve mode stdout is already routed to stderr, and swapping the global
+# streams from concurrent jobs would race, so suppression is skipped there
+_serving = '--serve' in sys.argv
 
 # Context manager to suppress stdout/stderr
 class SuppressOutput:
     def __enter__(self):
+        if _serving:
+            return
         self._original_stdout = sys.stdout
         self._original_stderr = sys.stderr
         sys.stdout = open(os.devnull, 'w')
         sys.stderr = open(os.devnull, 'w')
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if _serving:
+            return
         sys.stdout.close()
         sys.stderr.close()
         sys.stdout = self._original_stdout
         sys.stderr = self._original_stderr
 
-# Import heavy libs silently
-with SuppressOutput():
-    import cv2
-    import easyocr
-    import cv2
-    import easyocr
-    from ultralytics import YOLO
-    import re
+def iou_matrix(boxes_a, boxes_b):
+    # Pairwise IoU of (m, 4) and (n, 4) xyxy arrays, 0 where undefined
+    a = np.asarray(boxes_a, dtype=np.float64)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float64)[None, :, :]
+    inter_w = np.maximum(0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]))
+    inter_h = np.maximum(0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]))
+    inter = inter_w * inter_h
+    union = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1]) + (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1]) - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / union
+    return np.nan_to_num(iou, nan=0.0, posinf=0.0, neginf=0.0)
+
+# Loaded models, kept for the life of a --serve worker
+_models = {}
+_load_lock = threading.Lock()
+# YOLO predictors and the EasyOCR reader are not safe to call from several threads
+_infer_lock = threading.Lock()
 
-# Initialize EasyOCR Reader silently
-with SuppressOutput():
-    reader = easyocr.Reader(['en'], gpu=False)
+_reader = None
 
-def detect_violation(image_path, model_path='ml/runs/detect/train/weights/best.pt'):
+# ultralytics (torch) and easyocr are imported on first use: a frame without a
+# number plate never pays for the OCR stack
+def get_model(model_path):
+    with _load_lock:
+        if model_path not in _models:
+            with SuppressOutput():
+                from ultralytics import YOLO
+                _models[model_path] = YOLO(model_path)
+        return _models[model_path]
+
+def get_reader():
+    global _reader
+    with _load_lock:
+        if _reader is None:
+            with SuppressOutput():
+                import easyocr
+                _reader = easyocr.Reader(['en'], gpu=False)
+        return _reader
+
+def load_models():
+    if os.path.exists(DEFAULT_MODEL_PATH):
+        get_model(DEFAULT_MODEL_PATH)
+    get_reader()
+
+def detect_violation(image_path, model_path=DEFAULT_MODEL_PATH):
     # 1. Load Model
     # Try to load custom trained model first, else fallback to standard
     if os.path.exists(model_path):
-        with SuppressOutput():
-            model = YOLO(model_path)
+        model = get_model(model_path)
         using_custom = True
     else:
         return {
@@ -42,8 +87,8 @@ def detect_violation(image_path, model_path='ml/runs/detect/train/weights/best.p
         }
         
     # 2. Run Inference
-    with SuppressOutput():
-        results = model(image_path)
+    with SuppressOutput(), _infer_lock:
+        results = model(image_path, verbose=False)
     
     # Classes from user's yaml:
     # 0: "with helmet"
@@ -51,71 +96,36 @@ def detect_violation(image_path, model_path='ml/runs/detect/train/weights/best.p
     # 2: "rider"
     # 3: "number plate"
     
-    violations = []
     plate_text = ""
-    boxes_data = []
-    
-    # Helper to calculate IoU
-    def get_iou(boxA, boxB):
-        xA = max(boxA[0], boxB[0])
-        yA = max(boxA[1], boxB[1])
-        xB = min(boxA[2], boxB[2])
-        yB = min(boxA[3], boxB[3])
-        interArea = max(0, xB - xA) * max(0, yB - yA)
-        boxAArea = (boxA[2] - boxA[0]) * (boxA[3] - boxA[1])
-        boxBArea = (boxB[2] - boxB[0]) * (boxB[3] - boxB[1])
-        iou = interArea / float(boxAArea + boxBArea - interArea)
-        return iou
-
-    # Collect all boxes first
-    all_boxes = []
-    for r in results:
-        for box in r.boxes:
-            cls = int(box.cls[0])
-            conf = float(box.conf[0])
-            xyxy = box.xyxy[0].tolist()
-            label = model.names[cls]
-            all_boxes.append({
-                "label": label,
-                "confidence": conf,
-                "bbox": xyxy,
-                "cls": cls
-            })
     
-    # Process Logic
-    for box_data in all_boxes:
-        cls = box_data['cls']
-        conf = box_data['confidence']
-        xyxy = box_data['bbox']
-        label = box_data['label']
-        
-        boxes_data.append({
-            "label": label,
-            "confidence": conf,
-            "bbox": xyxy
-        })
-        
+    # Collect all boxes first, as arrays
+    xyxy = np.concatenate([r.boxes.xyxy.cpu().numpy().reshape(-1, 4) for r in results])
+    cls = np.concatenate([r.boxes.cls.cpu().numpy() for r in results]).astype(int)
+    conf = np.concatenate([r.boxes.conf.cpu().numpy() for r in results])
+    bboxes = xyxy.tolist()
+    confs = conf.tolist()
+    classes = cls.tolist()
+    labels = [model.names[c] for c in classes]
+    boxes_data = [
+        {"label": label, "confidence": c, "bbox": bbox}
+        for label, c, bbox in zip(labels, confs, bboxes)
+    ]
+
+    # "without helmet" boxes overlapping a conflicting "with helmet" detection are false positives
+    candidates = np.flatnonzero((cls == 1) & (conf > 0.5))
+    helmets = np.flatnonzero(np.array([label == 'with helmet' for label in labels], dtype=bool) & (conf > 0.25))
+    if len(candidates) and len(helmets):
+        candidates = candidates[~(iou_matrix(xyxy[candidates], xyxy[helmets]) > 0.25).any(axis=1)]
+    violations = [
+        {"type": "No Helmet", "confidence": confs[i], "bbox": bboxes[i]}
+        for i in candidates.tolist()
+    ]
+
+    for xyxy_box, box_cls in zip(bboxes, classes):
         # Helper to crop image for OCR
-        x1, y1, x2, y2 = map(int, xyxy)
-            
-        if cls == 1: # without helmet
-            # Check if we have a conflicting "with helmet" detection
-            is_false_positive = False
-            for other_box in all_boxes:
-                if other_box['label'] == 'with helmet' and other_box['confidence'] > 0.25:
-                    iou = get_iou(xyxy, other_box['bbox'])
-                    if iou > 0.25: # Significant overlap
-                        is_false_positive = True
-                        break
-            
-            if not is_false_positive and conf > 0.5:
-                violations.append({
-                    "type": "No Helmet",
-                    "confidence": conf,
-                    "bbox": xyxy
-                })
-        
-        if cls == 3: # number plate
+        x1, y1, x2, y2 = map(int, xyxy_box)
+
+        if box_cls == 3: # number plate
             # Crop and read
             img = cv2.imread(image_path)
             if img is not None:
@@ -135,7 +145,9 @@ def detect_violation(image_path, model_path='ml/runs/detect/train/weights/best.p
                 enhanced = clahe.apply(gray)
                 
                 # OCR with detail=1 to get bounding boxes
-                ocr_results = reader.readtext(enhanced, detail=1)
+                reader = get_reader()
+                with _infer_lock:
+                    ocr_results = reader.readtext(enhanced, detail=1)
 
                 if ocr_results:
                     # Robust Sorting: Top-to-Bottom, Left-to-Right
@@ -216,6 +228,12 @@ def detect_violation(image_path, model_path='ml/runs/detect/train/weights/best.p
     }
 
 if __name__ == "__main__":
+    if _serving:
+        # Jobs: {"id": ..., "args": [image_path, model_path?]}
+        import job_server
+        job_server.serve(detect_violation, load=load_models)
+        sys.exit(0)
+
     if len(sys.argv) < 2:
         print(json.dumps({"error": "Missing image path"}))
         sys.exit(1)
@@ -223,7 +241,7 @@ if __name__ == "__main__":
     img_path = sys.argv[1]
     
     # Optional: Allow passing model path as 2nd arg
-    model_p = 'ml/runs/detect/train/weights/best.pt'
+    model_p = DEFAULT_MODEL_PATH
     if len(sys.argv) > 2:
         model_p = sys.argv[2]
         
@@ -0,0 +1,169 @@
+"""
+Export the helmet / number-plate detector to a CPU-optimized runtime and report
+what it costs in accuracy and what it buys in latency and memory.
+
+Usage (from the project root):
+    python ml/scripts/export_helmet_model.py                      # OpenVINO FP32
+    python ml/scripts/export_helmet_model.py --int8               # OpenVINO INT8, calibrated on ml/dataset/val
+    python ml/scripts/export_helmet_model.py --format onnx --half
+
+The exported model is written next to the weights (e.g. best_int8_openvino_model/)
+and a JSON report to <export>/export_report.json. The export takes any batch of up to
+--batch frames (YOLO_BATCH_SIZE), and the report checks that batched and one-at-a-time
+detections agree for both models. Copy the export next to best.pt in python_backend
+and the backend picks it up automatically.
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+DEFAULT_WEIGHTS = 'ml/runs/detect/train/weights/best.pt'
+DEFAULT_DATA = 'ml/dataset/coco128.yaml'
+DEFAULT_RESULTS = 'ml/runs/detect/train/results.csv'
+VAL_IMAGES = 'ml/dataset/val/images'
+
+
+def training_metrics(results_csv):
+    """Metrics of the epoch best.pt was saved from (ultralytics fitness = 0.1 mAP50 + 0.9 mAP50-95)."""
+    with open(results_csv) as f:
+        rows = [{k.strip(): v for k, v in row.items()} for row in csv.DictReader(f)]
+    best = max(rows, key=lambda r: 0.1 * float(r['metrics/mAP50(B)']) + 0.9 * float(r['metrics/mAP50-95(B)']))
+    return {
+        "epoch": int(best['epoch']),
+        "precision": float(best['metrics/precision(B)']),
+        "recall": float(best['metrics/recall(B)']),
+        "mAP50": float(best['metrics/mAP50(B)']),
+        "mAP50-95": float(best['metrics/mAP50-95(B)']),
+    }
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _profile(model_path, images, imgsz, queue):
+    # Runs in a fresh process so each backend's memory is measured in isolation
+    import cv2
+    from ultralytics import YOLO
+
+    base = _rss_mb()
+    model = YOLO(model_path, task='detect')
+    frames = [cv2.imread(p) for p in images]
+    model(frames[0], imgsz=imgsz, verbose=False)  # warm-up
+    start = time.perf_counter()
+    for frame in frames:
+        model(frame, imgsz=imgsz, verbose=False)
+    latency = (time.perf_counter() - start) / len(frames) * 1000
+    queue.put({"latency_ms": round(latency, 2), "rss_mb": round(_rss_mb() - base, 1)})
+
+
+def profile(model_path, images, imgsz):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_profile, args=(model_path, images, imgsz, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def _detections(result):
+    boxes = result.boxes
+    return boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy(), boxes.conf.cpu().numpy()
+
+
+def batch_agreement(model_path, images, imgsz, batch):
+    """
+    Whether `batch` frames per forward pass give the same detections as one frame per
+    pass (same classes, boxes within 1 px, confidences within 0.01), as the backend
+    sends up to YOLO_BATCH_SIZE frames at once. The last batch is a partial one.
+    """
+    import cv2
+    import numpy as np
+    from ultralytics import YOLO
+
+    model = YOLO(model_path, task='detect')
+    frames = [cv2.imread(p) for p in images]
+    single = [_detections(model(frame, imgsz=imgsz, verbose=False)[0]) for frame in frames]
+    batched = []
+    for i in range(0, len(frames), batch):
+        batched.extend(_detections(r) for r in model(frames[i:i + batch], imgsz=imgsz, verbose=False))
+    mismatches = 0
+    for (xa, ca, pa), (xb, cb, pb) in zip(single, batched):
+        same = len(ca) == len(cb) and np.array_equal(ca, cb) and np.allclose(xa, xb, atol=1.0) and np.allclose(pa, pb, atol=0.01)
+        mismatches += not same
+    return {"batch": batch, "images": len(frames), "mismatches": mismatches, "identical": mismatches == 0}
+
+
+def validate(model_path, data, imgsz):
+    from ultralytics import YOLO
+
+    metrics = YOLO(model_path, task='detect').val(data=data, imgsz=imgsz, batch=1, device='cpu', verbose=False, plots=False)
+    return {
+        "precision": round(float(metrics.box.mp), 5),
+        "recall": round(float(metrics.box.mr), 5),
+        "mAP50": round(float(metrics.box.map50), 5),
+        "mAP50-95": round(float(metrics.box.map), 5),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--weights', default=DEFAULT_WEIGHTS)
+    parser.add_argument('--format', default='openvino', choices=['openvino', 'onnx'])
+    parser.add_argument('--int8', action='store_true', help='INT8 post-training quantization (calibrated on the val split)')
+    parser.add_argument('--half', action='store_true', help='FP16 weights')
+    parser.add_argument('--data', default=DEFAULT_DATA)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch', type=int, default=int(os.environ.get("YOLO_BATCH_SIZE", "8")),
+                        help='Largest batch the export must accept (the backend sends up to YOLO_BATCH_SIZE frames)')
+    parser.add_argument('--results', default=DEFAULT_RESULTS)
+    parser.add_argument('--profile-images', type=int, default=50, help='Val images used for latency/memory')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.weights):
+        print(json.dumps({"error": f"Weights not found: {args.weights}"}))
+        sys.exit(1)
+
+    from ultralytics import YOLO
+
+    print(f"Exporting {args.weights} to {args.format} (int8={args.int8}, half={args.half})...")
+    # Dynamic batch: the backend's batcher sends anything from 1 to YOLO_BATCH_SIZE frames per pass
+    exported = YOLO(args.weights).export(
+        format=args.format, int8=args.int8, half=args.half, data=args.data, imgsz=args.imgsz,
+        dynamic=True, batch=args.batch
+    )
+
+    images = sorted(glob.glob(os.path.join(VAL_IMAGES, '*')))[:args.profile_images]
+    report = {
+        "export": str(exported),
+        "format": args.format,
+        "int8": args.int8,
+        "half": args.half,
+        "training_metrics": training_metrics(args.results) if os.path.exists(args.results) else None,
+        "pytorch": {**validate(args.weights, args.data, args.imgsz), **profile(args.weights, images, args.imgsz)},
+        "exported": {**validate(exported, args.data, args.imgsz), **profile(exported, images, args.imgsz)},
+        "batched_vs_single": {
+            "pytorch": batch_agreement(args.weights, images, args.imgsz, args.batch),
+            "exported": batch_agreement(exported, images, args.imgsz, args.batch),
+        },
+    }
+    for key in ("mAP50", "mAP50-95"):
+        report[f"{key}_delta"] = round(report["exported"][key] - report["pytorch"][key], 5)
+    report["speedup"] = round(report["pytorch"]["latency_ms"] / report["exported"]["latency_ms"], 2)
+
+    out_dir = exported if os.path.isdir(exported) else os.path.dirname(exported)
+    with open(os.path.join(out_dir, 'export_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
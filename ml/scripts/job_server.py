@@ -0,0 +1,125 @@
+"""
+Long-lived worker mode shared by the ml/scripts CLI tools.
+
+`python ml/scripts/<tool>.py --serve [--socket PATH] [--workers N]` loads the
+models once and then reads newline-delimited JSON jobs, either on stdin or from
+any number of clients on a Unix socket:
+
+    {"id": 1, "args": ["<same positional args as the one-shot CLI>"]}
+
+Every job gets exactly one line back, in completion order (match on "id"):
+
+    {"id": 1, "result": {...same JSON the one-shot CLI prints...}}
+
+A {"ready": true} line is written once the models are loaded. Up to `--workers`
+jobs run at once; the tool serializes its own model calls where needed.
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+def _protocol_stdout():
+    """
+    Keeps the real stdout for protocol lines and points fd 1 (and sys.stdout)
+    at stderr, so library prints and progress bars cannot corrupt the stream.
+    """
+    sys.stdout.flush()
+    out = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    return out
+
+
+class _Channel:
+    def __init__(self, out):
+        self._out = out
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        line = json.dumps(message) + "\n"
+        with self._lock:
+            try:
+                self._out.write(line)
+                self._out.flush()
+            except (BrokenPipeError, ValueError, OSError):
+                pass  # client went away; its remaining results are dropped
+
+
+def _run(handle, channel, line):
+    job_id = None
+    try:
+        job = json.loads(line)
+        job_id = job.get("id")
+        result = handle(*job.get("args", []))
+    except Exception as e:
+        result = {"error": str(e)}
+    channel.send({"id": job_id, "result": result})
+
+
+def _pump(lines, handle, channel, executor):
+    futures = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            futures.append(executor.submit(_run, handle, channel, line))
+    return futures
+
+
+def serve(run_job, argv=None, load=None):
+    """
+    Runs the worker loop. `run_job(*args)` answers one job; `load()` (optional)
+    loads the models before the ready line is sent.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', action='store_true')
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of stdin/stdout')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('ML_WORKER_JOBS', '4')),
+                        help='Jobs processed concurrently')
+    args = parser.parse_args(argv)
+
+    stdout = _protocol_stdout()
+    if load:
+        load()
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    if not args.socket:
+        channel = _Channel(stdout)
+        channel.send({"ready": True})
+        _pump(sys.stdin, run_job, channel, executor)
+        executor.shutdown(wait=True)
+        return
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            channel = _Channel(_TextWriter(self.wfile))
+            # A client may close its sending side early; answer everything it sent first
+            wait(_pump((raw.decode('utf-8') for raw in self.rfile), run_job, channel, executor))
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = socketserver.ThreadingUnixStreamServer(args.socket, Handler)
+    server.daemon_threads = True
+    _Channel(stdout).send({"ready": True, "socket": args.socket})
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+class _TextWriter:
+    """Text-mode facade over a socket's binary write file."""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def write(self, text):
+        self._wfile.write(text.encode('utf-8'))
+
+    def flush(self):
+        self._wfile.flush()
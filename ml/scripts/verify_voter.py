@@ -1,22 +1,35 @@
-import easyocr
 import sys
 import json
 import re
 import os
 import logging
+import threading
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Initialize reader once
-reader = easyocr.Reader(['en'], gpu=False)
+# Reader is built once, on first use (easyocr pulls in torch)
+_reader = None
+_load_lock = threading.Lock()
+# Concurrent --serve jobs share the reader, which is not thread-safe
+_reader_lock = threading.Lock()
+
+def get_reader():
+    global _reader
+    with _load_lock:
+        if _reader is None:
+            import easyocr
+            _reader = easyocr.Reader(['en'], gpu=False)
+        return _reader
 
 def extract_text(image_path):
     if not os.path.exists(image_path):
         return []
     try:
         logging.info(f"Reading text from: {image_path}")
-        result = reader.readtext(image_path, detail=0)
+        reader = get_reader()
+        with _reader_lock:
+            result = reader.readtext(image_path, detail=0)
         return result
     except Exception as e:
         logging.error(f"Error reading text: {e}")
@@ -102,6 +115,12 @@ def verify_voter_card(front_path, back_path, voter_id_input):
     }
 
 if __name__ == "__main__":
+    if '--serve' in sys.argv:
+        # Jobs: {"id": ..., "args": [front_path, back_path, voter_id]}
+        import job_server
+        job_server.serve(verify_voter_card, load=get_reader)
+        sys.exit(0)
+
     try:
         # Args: script.py front_path back_path voter_id
         if len(sys.argv) < 4:
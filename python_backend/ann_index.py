@@ -0,0 +1,269 @@
+"""
+In-process vector indexes for duplicate search.
+
+Two interchangeable implementations share the same small interface
+(`add`, `remove`, `search`, `__len__`, `__contains__`):
+- FlatIndex: exact brute-force scan, used as the recall baseline.
+- IVFIndex: inverted-file index. Vectors are bucketed by their nearest k-means
+  centroid and a query only scans the `nprobe` closest buckets.
+
+Vectors are stored L2-normalized so inner product == cosine similarity.
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+
+import scoring
+
+# "ivf", "flat", "mmap" (shared on-disk store, see embedding_store.py) or "none" (full scan)
+INDEX_KIND = os.environ.get("DUPLICATE_INDEX", "ivf")
+IVF_NPROBE = int(os.environ.get("DUPLICATE_INDEX_NPROBE", "8"))
+IVF_TRAIN_MIN = int(os.environ.get("DUPLICATE_INDEX_TRAIN_MIN", "2000"))
+
+
+class _Bucket:
+    """Growable row store with O(1) swap-remove."""
+
+    def __init__(self, dim):
+        self.ids = []
+        self.vecs = np.zeros((16, dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, issue_id, vec):
+        n = len(self.ids)
+        if n == len(self.vecs):
+            grown = np.zeros((n * 2, self.vecs.shape[1]), dtype=np.float32)
+            grown[:n] = self.vecs
+            self.vecs = grown
+        self.vecs[n] = vec
+        self.ids.append(issue_id)
+        return n
+
+    def pop(self, row):
+        """Removes `row`; returns the id that moved into its place (or None)."""
+        last = len(self.ids) - 1
+        moved = None
+        if row != last:
+            self.vecs[row] = self.vecs[last]
+            self.ids[row] = self.ids[last]
+            moved = self.ids[row]
+        self.ids.pop()
+        return moved
+
+    def scores(self, query):
+        return self.vecs[:len(self.ids)] @ query
+
+
+class FlatIndex:
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._buckets = [_Bucket(dim)]
+        self._where = {}  # issue id -> (bucket, row)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, issue_id):
+        return issue_id in self._where
+
+    def _bucket_for(self, vec):
+        return 0
+
+    def add(self, issue_id, vec):
+        """Inserts or replaces the vector for `issue_id`."""
+        vec = scoring.normalize_rows(vec)[0]
+        with self._lock:
+            if issue_id in self._where:
+                self._remove(issue_id)
+            b = self._bucket_for(vec)
+            self._where[issue_id] = (b, self._buckets[b].append(issue_id, vec))
+            self._after_add()
+
+    def remove(self, issue_id):
+        with self._lock:
+            if issue_id in self._where:
+                self._remove(issue_id)
+
+    def _remove(self, issue_id):
+        b, row = self._where.pop(issue_id)
+        moved = self._buckets[b].pop(row)
+        if moved is not None:
+            self._where[moved] = (b, row)
+
+    def _after_add(self):
+        pass
+
+    def _probe(self, query):
+        return range(len(self._buckets))
+
+    def search(self, vec, k=10, exclude=None):
+        """Returns up to `k` (issue_id, cosine score) pairs, best first."""
+        query = scoring.normalize_rows(vec)[0]
+        with self._lock:
+            ids, scores = [], []
+            for b in self._probe(query):
+                bucket = self._buckets[b]
+                if len(bucket):
+                    ids.extend(bucket.ids)
+                    scores.append(bucket.scores(query))
+        if not ids:
+            return []
+        scores = np.concatenate(scores)
+        if exclude is not None and exclude in ids:
+            scores[ids.index(exclude)] = -np.inf
+        k = min(k, len(ids))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(ids[i], float(scores[i])) for i in best if scores[i] != -np.inf]
+
+
+class IVFIndex(FlatIndex):
+    """
+    Behaves like FlatIndex until `train_min` vectors are present, then trains
+    sqrt(n) centroids and re-buckets. It retrains when the index has grown 4x
+    since the last training so bucket sizes stay balanced.
+    """
+
+    def __init__(self, dim=384, nprobe=IVF_NPROBE, train_min=IVF_TRAIN_MIN):
+        super().__init__(dim)
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.centroids = None
+        self._trained_at = 0
+
+    def _bucket_for(self, vec):
+        if self.centroids is None:
+            return 0
+        return int(np.argmax(self.centroids @ vec))
+
+    def _after_add(self):
+        n = len(self._where)
+        if n >= self.train_min and (self.centroids is None or n >= self._trained_at * 4):
+            self.train()
+
+    def _probe(self, query):
+        if self.centroids is None:
+            return range(len(self._buckets))
+        nprobe = min(self.nprobe, len(self.centroids))
+        return np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+    def train(self, iterations=10, sample_size=20000, seed=0):
+        with self._lock:
+            ids = [i for bucket in self._buckets for i in bucket.ids]
+            vecs = np.vstack([bucket.vecs[:len(bucket)] for bucket in self._buckets])
+            nlist = max(1, int(np.sqrt(len(ids))))
+            self.centroids = _spherical_kmeans(vecs, nlist, iterations, sample_size, seed)
+            self._buckets = [_Bucket(self.dim) for _ in range(nlist)]
+            self._where = {}
+            for issue_id, vec in zip(ids, vecs):
+                b = self._bucket_for(vec)
+                self._where[issue_id] = (b, self._buckets[b].append(issue_id, vec))
+            self._trained_at = len(ids)
+            logging.info(f"IVF index trained: {len(ids)} vectors, {nlist} lists.")
+
+
+def _spherical_kmeans(vecs, k, iterations, sample_size, seed):
+    rng = np.random.default_rng(seed)
+    sample = vecs if len(vecs) <= sample_size else vecs[rng.choice(len(vecs), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=k) == 0
+        # Re-seed empty clusters from random points so every list stays usable
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = scoring.normalize_rows(sums)
+    return centroids
+
+
+def make_index(kind=INDEX_KIND, dim=384, name="default"):
+    """`name` keeps the on-disk indexes of different databases apart (kind "mmap")."""
+    if kind == "flat":
+        return FlatIndex(dim)
+    if kind == "mmap":
+        import embedding_store
+        return embedding_store.open_store(name, dim)
+    return IVFIndex(dim)
+
+
+def recall_at_k(index, exact, queries, k=10):
+    """Fraction of the exact top-k neighbours that `index` also returns, averaged over `queries`."""
+    hits = total = 0
+    for q in queries:
+        truth = {i for i, _ in exact.search(q, k)}
+        found = {i for i, _ in index.search(q, k)}
+        hits += len(truth & found)
+        total += len(truth)
+    return hits / total if total else 1.0
+
+
+# Process-wide indexes, one per (kind, mongo uri, database). Each is built on its own
+# thread, so a slow build (the image index downloads every photo) never holds up
+# requests or the builds of other indexes.
+_indexes = {}
+_building = {}  # key -> build thread
+_backlog = {}  # key -> updates that arrived during its build
+_indexes_lock = threading.Lock()  # guards the three dicts only, never held during a build
+
+
+def _build(key, build):
+    try:
+        index = build()
+    except Exception as e:
+        logging.error(f"Building index {key[0]} failed: {e}")
+        with _indexes_lock:
+            _building.pop(key, None)
+            _backlog.pop(key, None)
+        return
+    while True:
+        with _indexes_lock:
+            updates = _backlog.pop(key, [])
+            if not updates:
+                # Published together with the end of the build, so no update falls in between
+                _indexes[key] = index
+                _building.pop(key, None)
+                return
+        for update in updates:
+            update(index)
+
+
+def get_index(key, build, wait=False):
+    """
+    Returns the index for `key`. On first use `build()` starts on a background thread;
+    until it finishes this returns None, or blocks if `wait` is set. A failed build is
+    started again on the next call.
+    """
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+        thread = _building.get(key)
+        if thread is None:
+            thread = threading.Thread(target=_build, args=(key, build), name=f"build-{key[0]}-index", daemon=True)
+            _building[key] = thread
+            thread.start()
+    if not wait:
+        return None
+    thread.join()
+    return _indexes.get(key)
+
+
+def update_index(key, update):
+    """
+    Applies `update(index)` to the index for `key`. During its build the update is queued
+    and replayed once the build is done. Before any build nothing is needed: the build
+    reads the current state from Mongo.
+    """
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            if key in _building:
+                _backlog.setdefault(key, []).append(update)
+            return
+    update(index)
@@ -1,13 +1,20 @@
-import sys
-import os
-import shutil
 import base64
-import json
 import logging
-from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body
+import os
+import threading
+import time
+from typing import List, Optional
+from fastapi import FastAPI, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import uvicorn
+
+# Only light modules are imported here. Endpoint logic (cv2, sklearn, pymongo...) is
+# imported on first use inside the worker pools, and the ML frameworks (torch,
+# easyocr, ultralytics, sentence-transformers) only by model_registry loaders, so
+# startup stays within the import budget checked by `benchmarks.py imports`.
+import image_ingest
+import inference
+import result_cache
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
@@ -24,29 +31,116 @@ app = FastAPI()
 # For now, I will use `subprocess` or imports. Imports are better for persistent memory (loading models once).
 
 # --- MODEL LOADING ---
-from sentence_transformers import SentenceTransformer
-import easyocr
-# from ultralytics import YOLO # Load on demand or global
-
-# Global Models (Lazy Load)
-_sentence_model = None
-_ocr_reader = None
-
-def get_sentence_model():
-    global _sentence_model
-    if _sentence_model is None:
-        _sentence_model = SentenceTransformer('all-MiniLM-L6-v2')
-    return _sentence_model
-
-def get_ocr_reader():
-    global _ocr_reader
-    if _ocr_reader is None:
-        _ocr_reader = easyocr.Reader(['en'], gpu=False)
-    return _ocr_reader
+# Models are owned by model_registry and loaded once per process.
+import model_registry
+
+@app.on_event("startup")
+def start_model_warm_up():
+    # Load OCR, YOLO and the sentence encoder in parallel without delaying liveness; /ready tracks progress
+    model_registry.warm_up_in_background()
+
+@app.on_event("startup")
+def start_index_builds():
+    # Duplicate indexes of the configured database build in the background; until they are
+    # ready /detect-duplicates uses the blocked or full-scan path
+    mongo_uri = os.environ.get("MONGODB_URI")
+    if not mongo_uri:
+        return
+    def build():
+        try:
+            import detect_duplicates_logic
+            detect_duplicates_logic.prepare_indexes(mongo_uri, os.environ.get("MONGODB_DB_NAME", ""))
+        except Exception as e:
+            logger.error(f"Index warm-up failed: {e}")
+    threading.Thread(target=build, name="index-warm-up", daemon=True).start()
+
+# Seconds from process start to the first successful response of each model endpoint
+_first_useful_response = {}
+
+@app.middleware("http")
+async def record_first_useful_response(request: Request, call_next):
+    response = await call_next(request)
+    path = request.url.path
+    if response.status_code == 200 and path not in ("/", "/ready") and path not in _first_useful_response:
+        _first_useful_response[path] = round(time.monotonic() - model_registry.PROCESS_START, 3)
+        logger.info(f"First useful response for {path} after {_first_useful_response[path]}s")
+    return response
+
+@app.on_event("shutdown")
+def close_mongo_clients():
+    import mongo
+    mongo.close_all()
 
+@app.exception_handler(inference.CapacityError)
+async def capacity_error_handler(request: Request, exc: inference.CapacityError):
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(image_ingest.ImageRejected)
+async def image_rejected_handler(request: Request, exc: image_ingest.ImageRejected):
+    # Decompression bombs and oversized photos, refused before decoding
+    return JSONResponse(status_code=413, content={"error": str(exc)})
+
+# Runs on the event loop itself: model work is always on the inference pools, so this stays responsive
 @app.get("/")
-def health_check():
-    return {"status": "ok", "message": "Civic Lens AI Backend is running"}
+async def health_check():
+    return {"status": "ok", "message": "Civic Lens AI Backend is running", "inference": inference.stats(), "cache": result_cache.stats()}
+
+@app.get("/ready")
+async def readiness_check():
+    status = model_registry.status()
+    status["first_useful_response_seconds"] = _first_useful_response
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+# --- BINARY UPLOADS ---
+# multipart and application/octet-stream variants of the image endpoints. The upload is
+# read into one preallocated buffer that np.frombuffer/cv2.imdecode use as-is, instead
+# of a base64 string in JSON (+33% on the wire) plus its .replace() and b64decode copies.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+def _too_large():
+    return HTTPException(status_code=413, detail=f"Image larger than {MAX_UPLOAD_BYTES} bytes")
+
+async def _read_raw_body(request: Request):
+    length = request.headers.get("content-length")
+    if length and length.isdigit():
+        if int(length) > MAX_UPLOAD_BYTES:
+            raise _too_large()
+        buf = bytearray(int(length))
+        pos = 0
+        async for chunk in request.stream():
+            end = pos + len(chunk)
+            if end > len(buf):
+                raise HTTPException(status_code=400, detail="Body longer than Content-Length")
+            buf[pos:end] = chunk
+            pos = end
+        return buf if pos == len(buf) else buf[:pos]
+    # Chunked transfer: size unknown up front, grow in place
+    buf = bytearray()
+    async for chunk in request.stream():
+        buf += chunk
+        if len(buf) > MAX_UPLOAD_BYTES:
+            raise _too_large()
+    return buf
+
+def _read_upload(upload: Optional[UploadFile]):
+    # Blocking (the part may be spooled to disk): called on the inference pools
+    if upload is None:
+        return None
+    f = upload.file
+    size = upload.size
+    if size is None:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+    if size > MAX_UPLOAD_BYTES:
+        raise _too_large()
+    buf = bytearray(size)
+    f.seek(0)
+    n = f.readinto(buf)
+    return buf if n == size else buf[:n]
 
 # --- VOTER VERIFICATION ---
 class VerifyVoterInput(BaseModel):
@@ -54,23 +148,67 @@ class VerifyVoterInput(BaseModel):
     frontImage: str # Base64
     backImage: Optional[str] = None # Base64
 
+# Part of every cache key: bump when the endpoint logic changes what it returns
+VERIFY_VOTER_LOGIC_VERSION = "verify-voter/5"
+DETECT_VIOLATION_LOGIC_VERSION = "detect-violation/3"
+
+def _verify_voter(data: VerifyVoterInput):
+    # EasyOCR `readtext` accepts bytes directly, so no temp files are needed.
+    # Runs on the OCR pool: importing the logic module and decoding base64 are blocking too.
+    # Decode base64
+    front_bytes = base64.b64decode(data.frontImage.replace("data:image/jpeg;base64,", "").replace("data:image/png;base64,", ""))
+    back_bytes = None
+    if data.backImage and data.backImage != "NONE":
+         back_bytes = base64.b64decode(data.backImage.replace("data:image/jpeg;base64,", "").replace("data:image/png;base64,", ""))
+
+    return _verify_voter_bytes(front_bytes, back_bytes, data.voterId)
+
+def _verify_voter_bytes(front_bytes, back_bytes, voter_id):
+    import verify_voter_logic
+
+    # Resubmitted cards (retries, double clicks, re-reviews) are answered from the cache
+    cache = result_cache.get_cache("verify-voter")
+    key = cache.key(["ocr"], VERIFY_VOTER_LOGIC_VERSION, verify_voter_logic.cache_settings(),
+                    front_bytes, back_bytes or b"", voter_id.upper().strip())
+    result = cache.get(key)
+    if result is None:
+        result = verify_voter_logic.verify_voter_card_memory(front_bytes, back_bytes, voter_id)
+        # An OCR outage must not be replayed to the retries this cache exists for
+        if "error" not in result:
+            cache.put(key, result)
+    return result
+
 @app.post("/verify-voter")
 async def verify_voter_endpoint(data: VerifyVoterInput):
     try:
-        # Save temp files for the existing logic to work (it expects paths)
-        # OR refactor logic to use bytes. Existing logic uses EasyOCR with file paths or bytes. 
-        # EasyOCR `readtext` accepts bytes directly!
-        
-        import verify_voter_logic
-        
-        # Decode base64
-        front_bytes = base64.b64decode(data.frontImage.replace("data:image/jpeg;base64,", "").replace("data:image/png;base64,", ""))
-        back_bytes = None
-        if data.backImage and data.backImage != "NONE":
-             back_bytes = base64.b64decode(data.backImage.replace("data:image/jpeg;base64,", "").replace("data:image/png;base64,", ""))
-
-        result = verify_voter_logic.verify_voter_card_memory(front_bytes, back_bytes, data.voterId)
-        return result
+        return await inference.run("ocr", _verify_voter, data)
+    except (inference.CapacityError, image_ingest.ImageRejected):
+        raise
+    except Exception as e:
+        logger.error(f"Verification Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _verify_voter_upload(front: UploadFile, back: Optional[UploadFile], voter_id: str):
+    return _verify_voter_bytes(_read_upload(front), _read_upload(back), voter_id)
+
+@app.post("/verify-voter/upload")
+async def verify_voter_upload_endpoint(voterId: str = Form(...), front: UploadFile = File(...), back: Optional[UploadFile] = File(None)):
+    try:
+        return await inference.run("ocr", _verify_voter_upload, front, back, voterId)
+    except (inference.CapacityError, image_ingest.ImageRejected, HTTPException):
+        raise
+    except Exception as e:
+        logger.error(f"Verification Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/verify-voter/raw")
+async def verify_voter_raw_endpoint(request: Request, voterId: str = Query(...)):
+    # Body: the front image only (use /verify-voter/upload to send both sides)
+    front = await _read_raw_body(request)
+    try:
+        return await inference.run("ocr", _verify_voter_bytes, front, None, voterId)
+    except (inference.CapacityError, image_ingest.ImageRejected):
+        raise
     except Exception as e:
         logger.error(f"Verification Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -80,49 +218,145 @@ class DuplicateCheckInput(BaseModel):
     issueId: str
     mongoUri: str
     dbName: str
+    refresh: bool = False # Ignore matches precomputed by feature_worker.py
+
+def _detect_duplicates(data: DuplicateCheckInput):
+    import detect_duplicates_logic
+    if not data.refresh:
+        matches = detect_duplicates_logic.precomputed_matches(data.mongoUri, data.issueId, data.dbName)
+        if matches is not None:
+            return {"matches": matches, "precomputed": True}
+    # We pass the ID and Mongo details. The script logic connects to Mongo.
+    # Note: 'project_root' is less relevant here if images are Base64.
+    # We'll pass a dummy root for now.
+    return detect_duplicates_logic.detect_duplicates(
+        data.mongoUri,
+        data.issueId,
+        "/app", # Dummy root for cloud env
+        data.dbName
+    )
 
 @app.post("/detect-duplicates")
 async def detect_duplicates_endpoint(data: DuplicateCheckInput):
     try:
-        import detect_duplicates_logic
-        # We pass the ID and Mongo details. The script logic connects to Mongo.
-        # Note: 'project_root' is less relevant here if images are Base64.
-        # We'll pass a dummy root for now.
-        
-        result = detect_duplicates_logic.detect_duplicates(
-            data.mongoUri, 
-            data.issueId, 
-            "/app", # Dummy root for cloud env
-            data.dbName
-        )
-        return result
+        return await inference.run("text", _detect_duplicates, data)
+    except inference.CapacityError:
+        raise
     except Exception as e:
         logger.error(f"Duplicate Error: {e}")
         return {"matches": [], "error": str(e)}
 
+class IndexIssueInput(BaseModel):
+    issueId: str
+    mongoUri: str
+    dbName: str
+
+def _sync_issue(data: IndexIssueInput):
+    import detect_duplicates_logic
+    return detect_duplicates_logic.sync_issue(data.mongoUri, data.issueId, data.dbName)
+
+@app.post("/index-issue")
+async def index_issue_endpoint(data: IndexIssueInput):
+    # Called by the web app after an issue is created, edited, rejected or deleted
+    try:
+        return await inference.run("text", _sync_issue, data)
+    except inference.CapacityError:
+        raise
+    except Exception as e:
+        logger.error(f"Index Sync Error: {e}")
+        return {"indexed": False, "error": str(e)}
+
 # --- TRAFFIC VIOLATION ---
 class ViolationInput(BaseModel):
     image: str # Base64
 
+class ViolationBatchInput(BaseModel):
+    images: List[str] # Base64, one per frame
+
+def _b64_image_bytes(b64_str):
+    # Handle header if present
+    if "," in b64_str:
+        b64_str = b64_str.split(",")[1]
+    return base64.b64decode(b64_str)
+
+def _violation_key(cache, image_bytes):
+    import detect_violation_logic
+    return cache.key(["yolo", "ocr"], DETECT_VIOLATION_LOGIC_VERSION, detect_violation_logic.cache_settings(), image_bytes)
+
+def _detect_violation(data: ViolationInput):
+    return _detect_violation_bytes(_b64_image_bytes(data.image))
+
+def _detect_violation_bytes(image_bytes):
+    import detect_violation_logic
+    cache = result_cache.get_cache("detect-violation")
+    key = _violation_key(cache, image_bytes)
+    result = cache.get(key)
+    if result is None:
+        result = detect_violation_logic.detect_violation_memory(image_bytes)
+        if "error" not in result:
+            cache.put(key, result)
+    return result
+
+def _detect_violation_batch(data: ViolationBatchInput):
+    import detect_violation_logic
+    images = [_b64_image_bytes(i) for i in data.images]
+    cache = result_cache.get_cache("detect-violation")
+    keys = [_violation_key(cache, image_bytes) for image_bytes in images]
+    results = [cache.get(key) for key in keys]
+    # Only frames not seen before go through YOLO
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        computed = detect_violation_logic.detect_violations_batch([images[i] for i in missing])
+        for i, result in zip(missing, computed):
+            results[i] = result
+            if "error" not in result:
+                cache.put(keys[i], result)
+    return {"results": results}
+
 @app.post("/detect-violation")
 async def detect_violation_endpoint(data: ViolationInput):
     try:
-        import detect_violation_logic
-        
-        # Decode base64
-        # Handle header if present
-        b64_str = data.image
-        if "," in b64_str:
-            b64_str = b64_str.split(",")[1]
-            
-        img_bytes = base64.b64decode(b64_str)
-        
-        result = detect_violation_logic.detect_violation_memory(img_bytes)
-        return result
+        return await inference.run("yolo", _detect_violation, data)
+    except (inference.CapacityError, image_ingest.ImageRejected):
+        raise
     except Exception as e:
         logger.error(f"Violation Detection Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/detect-violation/batch")
+async def detect_violation_batch_endpoint(data: ViolationBatchInput):
+    try:
+        return await inference.run("yolo", _detect_violation_batch, data)
+    except (inference.CapacityError, image_ingest.ImageRejected):
+        raise
+    except Exception as e:
+        logger.error(f"Batch Violation Detection Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _detect_violation_upload(image: UploadFile):
+    return _detect_violation_bytes(_read_upload(image))
+
+@app.post("/detect-violation/upload")
+async def detect_violation_upload_endpoint(image: UploadFile = File(...)):
+    try:
+        return await inference.run("yolo", _detect_violation_upload, image)
+    except (inference.CapacityError, image_ingest.ImageRejected, HTTPException):
+        raise
+    except Exception as e:
+        logger.error(f"Violation Detection Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/detect-violation/raw")
+async def detect_violation_raw_endpoint(request: Request):
+    image_bytes = await _read_raw_body(request)
+    try:
+        return await inference.run("yolo", _detect_violation_bytes, image_bytes)
+    except (inference.CapacityError, image_ingest.ImageRejected):
+        raise
+    except Exception as e:
+        logger.error(f"Violation Detection Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=7860) # 7860 is HF Spaces default port
@@ -0,0 +1,67 @@
+"""
+Request coalescing for batched model calls.
+
+`MicroBatcher` lets many threads submit single items and get a Future back.
+A background thread groups queued items into one `process_batch(items)` call,
+flushing when `max_batch_size` items are waiting or `max_wait_ms` has passed
+since the first one arrived.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=5, name="batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items):
+        """Bulk submit (e.g. backfills); items are flushed in full batches without waiting."""
+        return [self.submit(item) for item in items]
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logging.error(f"{self.name}: batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
@@ -7,21 +7,32 @@ import base64
 import io
 import logging
 from PIL import Image
-from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-import requests
+
+import ann_index
+import encoder
+import feature_store
+import geo_blocking
+import image_fetch
+import lexical_index
+import mongo
+import phash_index
+import scoring
 
 logging.basicConfig(level=logging.INFO)
 
-MODEL_NAME = 'all-MiniLM-L6-v2'
-_model = None
+MODEL_NAME = encoder.MODEL_NAME
+# How many nearest neighbours the ANN index hands to the exact text+image rescoring
+CANDIDATE_POOL = int(os.environ.get("DUPLICATE_CANDIDATE_POOL", "200"))
+# Max Hamming distance (of 256 bits) at which two pHashes still contribute an image score
+PHASH_TOLERANCE = 30
+# Candidate rows only need text and status; image bytes are never pulled for scoring
+CANDIDATE_FIELDS = {"title": 1, "description": 1, "status": 1}
+# The target also needs its location, category and date for the blocking stage, and its
+# image reference to tell whether the stored pHash is still current
+TARGET_FIELDS = {**CANDIDATE_FIELDS, **geo_blocking.BLOCKING_FIELDS, **feature_store.IMAGE_FIELDS}
 
 def get_model():
-    global _model
-    if _model is None:
-        _model = SentenceTransformer(MODEL_NAME)
-    return _model
+    return encoder.get_model()
 
 def get_image_phash(image_input):
     if not image_input:
@@ -38,12 +49,7 @@ def get_image_phash(image_input):
                 return None
         # Handle URL (Cloud storage) - IMPORTANT for Production
         elif isinstance(image_input, str) and image_input.startswith('http'):
-            try:
-                response = requests.get(image_input, stream=True)
-                if response.status_code == 200:
-                    img = Image.open(response.raw)
-            except:
-                return None
+            img = image_fetch.fetch_image(image_input)
         
         if img:
             return imagehash.phash(img, hash_size=16)
@@ -52,86 +58,298 @@ def get_image_phash(image_input):
         return None
     return None
 
+def phash_to_int(image_hash):
+    bits = np.asarray(image_hash.hash, dtype=bool).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def get_image_phash_int(image_input):
+    image_hash = get_image_phash(image_input)
+    return phash_to_int(image_hash) if image_hash is not None else None
+
+def get_image_phashes(images):
+    """
+    {issue_id: image input} -> {issue_id: packed pHash or None}.
+    Remote images are downloaded and hashed concurrently under a shared deadline;
+    anything slow or missing comes back as None and scores text-only.
+    """
+    urls = {k: v for k, v in images.items() if isinstance(v, str) and v.startswith('http')}
+    fetched = image_fetch.fetch_all(urls.values(), process=lambda img: phash_to_int(imagehash.phash(img, hash_size=16)))
+    out = {k: fetched[v] for k, v in urls.items()}
+    for k, v in images.items():
+        if k not in urls:
+            out[k] = get_image_phash_int(v)
+    return out
+
 def compare_hashes(hash1, hash2):
     if hash1 is None or hash2 is None:
         return 0.0
-    diff = hash1 - hash2
+    # Stored hashes are packed ints, freshly computed ones are ImageHash objects
+    diff = phash_index.hamming(hash1, hash2) if isinstance(hash1, int) else hash1 - hash2
     if diff == 0: return 1.0
-    if diff > 30: return 0.0
-    return 1.0 - (diff / 30.0)
+    if diff > PHASH_TOLERANCE: return 0.0
+    return 1.0 - (diff / float(PHASH_TOLERANCE))
 
 def get_text_embedding(text):
-    model = get_model()
-    if not model or not text.strip():
+    if not text.strip():
         return np.zeros((1, 384))
-    return model.encode([text])
+    return encoder.encode(text).reshape(1, -1)
+
+def encode_texts(texts):
+    # Goes through the shared batcher so concurrent checks coalesce into one encode call
+    return encoder.encode_many(texts)
 
 def compare_vectors(vec1, vec2):
+    # scikit-learn alone takes ~1s to import; only this legacy helper needs it
+    from sklearn.metrics.pairwise import cosine_similarity
     score = cosine_similarity(vec1, vec2)[0][0]
     return max(0.0, score)
 
+def _issue_image(doc):
+    return doc.get('imageUrl') or doc.get('image_url')
+
+def _image_loader(collection):
+    def load(issue_ids):
+        rows = collection.find({"_id": {"$in": issue_ids}}, feature_store.IMAGE_FIELDS)
+        return {row['_id']: _issue_image(row) for row in rows.batch_size(mongo.CURSOR_BATCH_SIZE)}
+    return load
+
+def _build_issue_index(db):
+    index = ann_index.make_index(name=db.name)
+    if getattr(index, 'persistent', False) and len(index):
+        # Shared on-disk index, already built by an earlier run or another worker
+        logging.info(f"Opened duplicate index with {len(index)} issues.")
+        return index
+    cursor = db['issues'].find({"status": {"$ne": "Rejected"}}, {"title": 1, "description": 1})
+    for batch in mongo.iter_batches(cursor):
+        embeddings = feature_store.get_text_embeddings(db, batch, encode_texts, MODEL_NAME)
+        if hasattr(index, 'add_many'):
+            index.add_many(list(embeddings), np.vstack(list(embeddings.values())))
+        else:
+            for issue_id, vec in embeddings.items():
+                index.add(issue_id, vec)
+    logging.info(f"Built duplicate index with {len(index)} issues.")
+    return index
+
+def _build_image_index(db):
+    index = phash_index.MultiIndexHash()
+    loader = _image_loader(db['issues'])
+
+    def add(digests):
+        hashes = feature_store.get_image_hashes(db, list(digests), loader, get_image_phashes, digests=digests)
+        for issue_id, image_hash in hashes.items():
+            index.add(issue_id, image_hash)
+
+    # Only the digest of each image reference is kept, so large data URIs are not held per batch
+    cursor = db['issues'].find({"status": {"$ne": "Rejected"}}, feature_store.IMAGE_FIELDS).batch_size(mongo.CURSOR_BATCH_SIZE)
+    digests = {}
+    for row in cursor:
+        digests[row['_id']] = feature_store.image_digest(row)
+        if len(digests) >= mongo.CURSOR_BATCH_SIZE:
+            add(digests)
+            digests = {}
+    if digests:
+        add(digests)
+    logging.info(f"Built image hash index with {len(index)} issues.")
+    return index
+
+def _build_lexical_index(db):
+    index = lexical_index.BM25Index()
+    cursor = db['issues'].find({"status": {"$ne": "Rejected"}}, {"title": 1, "description": 1})
+    for batch in mongo.iter_batches(cursor):
+        for row in batch:
+            index.add(row['_id'], feature_store.issue_text(row))
+    logging.info(f"Built lexical index with {len(index)} issues.")
+    return index
+
+def _index_key(kind, mongo_uri, db_name):
+    return (kind, mongo_uri, db_name or "")
+
+def get_issue_index(db, mongo_uri, db_name=None, wait=False):
+    # None while the index is still being built (unless `wait`)
+    return ann_index.get_index(_index_key("text", mongo_uri, db_name), lambda: _build_issue_index(db), wait)
+
+def get_image_index(db, mongo_uri, db_name=None, wait=False):
+    return ann_index.get_index(_index_key("image", mongo_uri, db_name), lambda: _build_image_index(db), wait)
+
+def get_lexical_index(db, mongo_uri, db_name=None, wait=False):
+    return ann_index.get_index(_index_key("lexical", mongo_uri, db_name), lambda: _build_lexical_index(db), wait)
+
+def prepare_indexes(mongo_uri, db_name=None, wait=False):
+    """Starts building (or, with `wait`, builds) every duplicate index of the database."""
+    if ann_index.INDEX_KIND == "none":
+        return
+    db = mongo.get_database(mongo_uri, db_name)
+    get_issue_index(db, mongo_uri, db_name, wait)
+    get_image_index(db, mongo_uri, db_name, wait)
+    if lexical_index.MODE != "off":
+        get_lexical_index(db, mongo_uri, db_name, wait)
+
+def _update_indexes(mongo_uri, db_name, issue_id, vec=None, image_hash=None, text=None, remove=False):
+    """Upserts (or removes) one issue in every index, now or once an index's build in progress is done."""
+    def apply(kind, add):
+        ann_index.update_index(_index_key(kind, mongo_uri, db_name),
+                               lambda index: index.remove(issue_id) if remove else add(index))
+    apply("text", lambda index: index.add(issue_id, vec))
+    apply("image", lambda index: index.add(issue_id, image_hash))
+    if lexical_index.MODE != "off":
+        apply("lexical", lambda index: index.add(issue_id, text))
+
+def rank_candidates(target_id, target_text, target_vec, index, lexical=None):
+    """
+    Issues worth rescoring exactly: the ANN neighbours, fused with (or, in prefilter
+    mode, replaced by) the BM25 matches of the target's text.
+    """
+    lexical_ids = []
+    if lexical is not None and lexical_index.MODE != "off":
+        lexical_ids = [i for i, _ in lexical.search(target_text, lexical_index.LEXICAL_POOL, exclude=target_id)]
+        if lexical_index.MODE == "prefilter" and lexical_ids:
+            return lexical_ids
+    vector_ids = [i for i, _ in index.search(target_vec, CANDIDATE_POOL, exclude=target_id)]
+    if not lexical_ids:
+        return vector_ids
+    return lexical_index.rrf([vector_ids, lexical_ids])[:CANDIDATE_POOL]
+
+def sync_issue(mongo_uri, issue_id, db_name=None, refresh_image=True):
+    """
+    Updates the ANN, lexical and image hash indexes after an issue is created, edited, rejected or deleted.
+    Re-encodes the text only if it changed; the image hash is recomputed unless `refresh_image` is off.
+    Indexes still being built receive the update when their build is done.
+    """
+    if ann_index.INDEX_KIND == "none":
+        return {"indexed": False}
+    db = mongo.get_database(mongo_uri, db_name)
+    prepare_indexes(mongo_uri, db_name)
+    issue = db['issues'].find_one({"_id": issue_id}, {**CANDIDATE_FIELDS, **feature_store.IMAGE_FIELDS})
+    if issue is None or issue.get('status') == "Rejected":
+        _update_indexes(mongo_uri, db_name, issue_id, remove=True)
+        return {"indexed": False}
+    vec = feature_store.get_text_embeddings(db, [issue], encode_texts, MODEL_NAME)[issue_id]
+    image_hash = feature_store.get_image_hashes(
+        db, [issue_id], _image_loader(db['issues']), get_image_phashes, refresh=refresh_image,
+        digests={issue_id: feature_store.image_digest(issue)},
+    )[issue_id]
+    _update_indexes(mongo_uri, db_name, issue_id, vec, image_hash, feature_store.issue_text(issue))
+    return {"indexed": True}
+
+def _index_target(db, mongo_uri, db_name, target, target_vec, target_img_phash):
+    """
+    Upserts the target into the ANN, image hash and lexical indexes. Returns
+    (index, image_index, lexical), with None for any index still being built.
+    """
+    if target.get('status') != "Rejected":
+        _update_indexes(mongo_uri, db_name, target['_id'], target_vec, target_img_phash, feature_store.issue_text(target))
+    index = get_issue_index(db, mongo_uri, db_name)
+    image_index = get_image_index(db, mongo_uri, db_name)
+    lexical = get_lexical_index(db, mongo_uri, db_name) if lexical_index.MODE != "off" else None
+    return index, image_index, lexical
+
+def _stream_candidates(db, collection, query, with_images):
+    """
+    Streams candidate rows in cursor batches and returns (rows, vectors, hashes).
+    Only `_id` and title are kept per row, so memory stays flat however large the collection is.
+    """
+    rows, vectors, hashes = [], [], {}
+    loader = _image_loader(collection)
+    for batch in mongo.iter_batches(collection.find(query, CANDIDATE_FIELDS)):
+        embeddings = feature_store.get_text_embeddings(db, batch, encode_texts, MODEL_NAME)
+        if with_images:
+            hashes.update(feature_store.get_image_hashes(db, [row['_id'] for row in batch], loader, get_image_phashes))
+        for row in batch:
+            rows.append({"_id": row['_id'], "title": row.get('title', '')})
+            vectors.append(embeddings[row['_id']])
+    return rows, vectors, hashes
+
+def precomputed_matches(mongo_uri, issue_id, db_name=None):
+    """
+    Matches stored by the feature worker (feature_worker.py), or None if there are none
+    or the issue was edited since. Matches that were deleted or rejected since are dropped.
+    """
+    db = mongo.get_database(mongo_uri, db_name)
+    issue = db['issues'].find_one({"_id": issue_id}, feature_store.SOURCE_FIELDS)
+    if issue is None:
+        return None
+    stored = feature_store.get_features_collection(db).find_one({"_id": issue_id}, {"matches": 1, "matches_sig": 1})
+    if not stored or stored.get('matches_sig') != feature_store.source_signature(issue, MODEL_NAME):
+        return None
+    matches = stored.get('matches') or []
+    live = {row['_id'] for row in db['issues'].find(
+        {"_id": {"$in": [m['id'] for m in matches]}, "status": {"$ne": "Rejected"}}, {"_id": 1})}
+    return [m for m in matches if m['id'] in live]
+
 def detect_duplicates(mongo_uri, target_issue_id, project_root, db_name=None):
     try:
-        client = MongoClient(mongo_uri)
-        db = client.get_database(db_name) if db_name else client.get_database()
+        db = mongo.get_database(mongo_uri, db_name)
         collection = db['issues']
     except Exception as e:
         return {"error": f"Database connection failed: {str(e)}"}
 
-    target = collection.find_one({"_id": target_issue_id})
+    target = collection.find_one({"_id": target_issue_id}, TARGET_FIELDS)
     if not target:
         return {"error": "Target issue not found"}
 
-    target_text = (target.get('title', "") or "") + ". " + (target.get('description', "") or "")
-    target_vec = get_text_embedding(target_text)
-    
-    target_img_phash = None
-    target_img_url = target.get('imageUrl') # Mongoose stores it as imageUrl, script had image_url?
-    # Checking schema: src/db/models/Issue.ts usually has imageUrl.
-    # Note: The original script used 'image_url' in some places, but schema likely matches.
-    # Let's fallback to checking both keys.
-    if not target_img_url: 
-         target_img_url = target.get('image_url')
-
-    if target_img_url:
-        target_img_phash = get_image_phash(target_img_url)
-
-    candidates = list(collection.find({
-        "_id": {"$ne": target_issue_id},
-        "status": {"$ne": "Rejected"}
-    }))
+    # pHashes are computed once per image and stored packed; the image is only loaded on a miss
+    # or when the issue's image reference changed
+    target_img_phash = feature_store.get_image_hashes(
+        db, [target_issue_id], _image_loader(collection), get_image_phashes,
+        digests={target_issue_id: feature_store.image_digest(target)},
+    )[target_issue_id]
+    target_vec = feature_store.get_text_embeddings(db, [target], encode_texts, MODEL_NAME)[target_issue_id]
+
+    index = image_index = lexical = None
+    if ann_index.INDEX_KIND != "none":
+        # The target joins every index even when blocking picks its candidates, so later
+        # checks (blocked or not) can find it
+        index, image_index, lexical = _index_target(db, mongo_uri, db_name, target, target_vec, target_img_phash)
+
+    # Nearby issues of the same category and period, when the target has coordinates
+    blocked = geo_blocking.select_candidates(collection, target)
+    if blocked is not None:
+        candidate_ids, radius = blocked
+        logging.info(f"Blocking kept {len(candidate_ids)} candidates within {radius} km.")
+        candidate_ids = list(candidate_ids)
+        if len(candidate_ids) < geo_blocking.MIN_CANDIDATES and index is not None:
+            # Too few nearby even at the widest radius: the global search fills the list up
+            candidate_ids += rank_candidates(target_issue_id, feature_store.issue_text(target), target_vec, index, lexical)
+    elif index is None:
+        # No ANN index (disabled, or still being built): score every issue
+        candidate_ids = None
+    else:
+        # Ask the ANN index for the nearest issues, then rescore only those exactly
+        candidate_ids = rank_candidates(target_issue_id, feature_store.issue_text(target), target_vec, index, lexical)
+
+    if candidate_ids is None:
+        query = {"_id": {"$ne": target_issue_id}, "status": {"$ne": "Rejected"}}
+    else:
+        # Near-identical photos are candidates wherever and under whatever category they were filed
+        if image_index is not None and target_img_phash is not None:
+            candidate_ids += [issue_id for issue_id, _ in image_index.search(target_img_phash, PHASH_TOLERANCE)
+                              if issue_id != target_issue_id]
+        query = {"_id": {"$in": list(dict.fromkeys(candidate_ids))}, "status": {"$ne": "Rejected"}}
+
+    candidates, vectors, hashes = _stream_candidates(db, collection, query, target_img_phash is not None)
+    if not candidates:
+        return {"matches": []}
+
+    # Score every candidate at once: one matrix-vector product over pre-normalized rows
+    matrix = scoring.normalize_rows(np.vstack(vectors))
+    text_scores = scoring.text_scores(target_vec, matrix)
+
+    image_scores = np.zeros(len(candidates))
+    if target_img_phash is not None:
+        for i, row in enumerate(candidates):
+            image_scores[i] = compare_hashes(target_img_phash, hashes.get(row['_id']))
+
+    final_scores = scoring.combine_scores(text_scores, image_scores)
 
     results = []
-    
-    for row in candidates:
-        c_text = (row.get('title', "") or "") + ". " + (row.get('description', "") or "")
-        c_vec = get_text_embedding(c_text)
-        
-        score_text = float(compare_vectors(target_vec, c_vec))
-        
-        score_image = 0.0
-        c_img_rel = row.get('imageUrl') or row.get('image_url')
-        
-        if c_img_rel and target_img_phash:
-            c_hash = get_image_phash(c_img_rel)
-            score_image = compare_hashes(target_img_phash, c_hash)
-
-        if score_image >= 0.95:
-            final_score = score_image
-        elif score_text >= 0.90:
-            final_score = score_text
-        else:
-            final_score = (score_text * 0.6) + (score_image * 0.4)
-
-        if final_score > 0.55:
-            results.append({
-                "id": str(row['_id']), # ID to string
-                "title": row.get('title', ''),
-                "score": round(final_score * 100, 1),
-                "image_score": round(score_image * 100, 1),
-                "text_score": round(score_text * 100, 1),
-                "match_type": "AI-Semantic"
-            })
-
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return {"matches": results[:10]}
+    for i in scoring.top_k(final_scores):
+        row = candidates[i]
+        results.append({
+            "id": str(row['_id']), # ID to string
+            "title": row.get('title', ''),
+            "score": round(float(final_scores[i]) * 100, 1),
+            "image_score": round(float(image_scores[i]) * 100, 1),
+            "text_score": round(float(text_scores[i]) * 100, 1),
+            "match_type": "AI-Semantic"
+        })
+    return {"matches": results}
@@ -1,26 +1,29 @@
 import cv2
-import easyocr
-from ultralytics import YOLO
 import numpy as np
+import os
 import re
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-# Initialize Reader & Model (Module Level)
-reader = easyocr.Reader(['en'], gpu=False)
-model = None
+import image_ingest
+import model_registry
+from batching import MicroBatcher
+
+# Images per YOLO forward pass, for both the batch endpoint and coalesced single requests
+YOLO_BATCH_SIZE = int(os.environ.get("YOLO_BATCH_SIZE", "8"))
+# How long a single-image request waits for others to share its forward pass
+YOLO_MAX_WAIT_MS = float(os.environ.get("YOLO_MAX_WAIT_MS", "10"))
+DECODE_WORKERS = int(os.environ.get("IMAGE_DECODE_WORKERS", "4"))
+
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="image-decode")
+
+def cache_settings():
+    """The ingest settings that can change a detection result, for the result cache key."""
+    return f"yolo_side={image_ingest.TARGETS['yolo']};plate_side={image_ingest.TARGETS['plate']}"
 
 def load_model():
-    global model
-    if model is None:
-        try:
-             # Expect 'best.pt' to be in the same directory or passed explicitly
-             model = YOLO("best.pt") 
-             logging.info("YOLO Model loaded.")
-        except Exception as e:
-             logging.error(f"Failed to load YOLO model: {e}")
-             # Fallback to standard model if local fails? 
-             # model = YOLO("yolov8n.pt")
-    return model
+    # YOLO_MODEL_PATH (default 'best.pt' next to the app); None if it failed to load
+    return model_registry.get("yolo")
 
 def get_iou(boxA, boxB):
     xA = max(boxA[0], boxB[0])
@@ -33,99 +36,216 @@ def get_iou(boxA, boxB):
     iou = interArea / float(boxAArea + boxBArea - interArea)
     return iou
 
-def detect_violation_memory(image_bytes):
-    current_model = load_model()
-    if not current_model:
-        return {"error": "Model not loaded"}
-        
-    # Convert bytes to cv2 image
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    if img is None:
-        return {"error": "Invalid image data"}
-        
-    results = current_model(img)
-    
-    violations = []
-    plate_text = ""
-    boxes_data = []
-    
-    all_boxes = []
-    for r in results:
-        for box in r.boxes:
-            cls = int(box.cls[0])
-            conf = float(box.conf[0])
-            xyxy = box.xyxy[0].tolist()
-            label = current_model.names[cls]
-            all_boxes.append({
-                "label": label,
-                "confidence": conf,
-                "bbox": xyxy,
-                "cls": cls
-            })
-            
-    for box_data in all_boxes:
-        cls = box_data['cls']
-        conf = box_data['confidence']
-        xyxy = box_data['bbox']
-        label = box_data['label']
-        
-        boxes_data.append({
-            "label": label,
-            "confidence": conf,
-            "bbox": xyxy
-        })
-        
-        x1, y1, x2, y2 = map(int, xyxy)
-        
-        # 1: without helmet, 3: number plate (Assuming standard classes from user yaml)
-        # Note: We should verify class IDs if possible, but assuming same model file.
-        
-        if label == "without helmet" or cls == 1: 
-             # Check false positive IoU with "with helmet"
-             is_false_positive = False
-             for other_box in all_boxes:
-                 if (other_box['label'] == 'with helmet' or other_box['cls'] == 0) and other_box['confidence'] > 0.25:
-                     iou = get_iou(xyxy, other_box['bbox'])
-                     if iou > 0.25: 
-                         is_false_positive = True
-                         break
-             
-             if not is_false_positive and conf > 0.5:
-                 violations.append({
-                     "type": "No Helmet",
-                     "confidence": conf,
-                     "bbox": xyxy
-                 })
-
-        if label == "number plate" or cls == 3:
-             roi = img[y1:y2, x1:x2]
-             # OCR Logic
-             try:
-                 # upscale
-                 scale = 3
-                 h, w = roi.shape[:2]
-                 roi_up = cv2.resize(roi, (w*scale, h*scale), interpolation=cv2.INTER_CUBIC)
-                 gray = cv2.cvtColor(roi_up, cv2.COLOR_BGR2GRAY)
-                 clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                 enhanced = clahe.apply(gray)
-                 
-                 ocr_results = reader.readtext(enhanced, detail=0)
-                 # Join and clean
-                 text_raw = " ".join(ocr_results).upper()
-                 text_clean = re.sub(r'[^A-Z0-9]', '', text_raw)
-                 
-                 # Simple logic: take the longest alphanumeric sequence that looks like a plate
-                 # Or just return the cleaned text
-                 if len(text_clean) > 4:
-                     plate_text = text_clean # Improve logic if needed
-             except Exception as e:
-                 logging.error(f"OCR Failed: {e}")
+def decode_image(image_bytes):
+    # A 640 px view for YOLO and a higher-resolution one for plate crops (None if undecodable;
+    # raises image_ingest.ImageRejected for decompression bombs)
+    return image_ingest.ingest(image_bytes, ("yolo", "plate"))
+
+def run_yolo_batch(images):
+    """One YOLO result per image, running forward passes of up to YOLO_BATCH_SIZE images."""
+    # Exports made without dynamic=True take exactly their export batch size
+    fixed = model_registry.yolo_fixed_batch()
+    step = fixed or YOLO_BATCH_SIZE
+    results = []
+    with model_registry.use("yolo") as current_model:
+        for i in range(0, len(images), step):
+            chunk = images[i:i + step]
+            if fixed and len(chunk) < fixed:
+                # Pad a partial batch with copies of its last frame and drop their results
+                results.extend(current_model(chunk + [chunk[-1]] * (fixed - len(chunk)), verbose=False)[:len(chunk)])
+            else:
+                results.extend(current_model(chunk, verbose=False))
+    return results
+
+# Merges concurrent single-image requests into shared forward passes
+_yolo_batcher = MicroBatcher(run_yolo_batch, YOLO_BATCH_SIZE, YOLO_MAX_WAIT_MS, name="yolo-batcher")
+
+# A plate crop at least this many times wider than tall can only hold one text line and
+# goes straight to the recognizer. Squarer crops (two-row motorcycle plates, loose or
+# tilted boxes) keep EasyOCR's text detector, as before. 0 always runs the detector.
+PLATE_SINGLE_LINE_RATIO = float(os.environ.get("PLATE_SINGLE_LINE_RATIO", "3"))
+PLATE_SCALE = 3
+
+def _is_single_line(h, w):
+    return PLATE_SINGLE_LINE_RATIO > 0 and w >= PLATE_SINGLE_LINE_RATIO * h
+
+def _preprocess_plate(img, xyxy):
+    x1, y1, x2, y2 = map(int, xyxy)
+    roi = img[y1:y2, x1:x2]
+    h, w = roi.shape[:2]
+    if h == 0 or w == 0:
+        return None
+    # The recognizer rescales every line to its own fixed height, so only crops that go
+    # through the detector are upscaled
+    if not _is_single_line(h, w):
+        roi = cv2.resize(roi, (w*PLATE_SCALE, h*PLATE_SCALE), interpolation=cv2.INTER_CUBIC)
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    return clahe.apply(gray)
+
+def read_plates(crops):
+    """
+    Plate text for each preprocessed grayscale crop ("" if unreadable).
+
+    Single-line crops skip EasyOCR's text detector: the YOLO box already isolates the
+    line, so it is recognized directly. Other crops are read with `readtext`. On CPU
+    EasyOCR recognizes one line at a time, so each crop is its own call; the reader is
+    taken once for all plates of the frame (or burst). `benchmarks.py plates` checks
+    the strings against detector-only reading.
+    """
+    texts = [""] * len(crops)
+    try:
+        with model_registry.use("ocr") as reader:
+            for i, crop in enumerate(crops):
+                if crop is None:
+                    continue
+                h, w = crop.shape
+                if _is_single_line(h, w):
+                    lines = reader.recognize(crop, horizontal_list=[[0, w, 0, h]], free_list=[], detail=0)
+                else:
+                    lines = reader.readtext(crop, detail=0)
+                texts[i] = re.sub(r"[^A-Z0-9]", "", " ".join(t for t in lines if t).upper())
+    except Exception as e:
+        logging.error(f"OCR Failed: {e}")
+    return texts
+
+# A "without helmet" box overlapping a confident "with helmet" box is the same rider seen twice
+SUPPRESS_CONF = 0.25
+SUPPRESS_IOU = 0.25
+VIOLATION_CONF = 0.5
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU of (m, 4) and (n, 4) xyxy arrays, same arithmetic as get_iou (0 where undefined)."""
+    a = np.asarray(boxes_a, dtype=np.float64)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float64)[None, :, :]
+    inter_w = np.maximum(0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]))
+    inter_h = np.maximum(0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]))
+    inter = inter_w * inter_h
+    union = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1]) + (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1]) - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / union
+    return np.nan_to_num(iou, nan=0.0, posinf=0.0, neginf=0.0)
+
+def _class_mask(cls, names, label, class_id):
+    ids = [k for k, v in names.items() if v == label]
+    return np.isin(cls, ids + [class_id])
+
+def helmet_violations(xyxy, cls, conf, names):
+    """Indices of "No Helmet" boxes: confident, and not overlapping a "with helmet" box."""
+    candidates = np.flatnonzero(_class_mask(cls, names, "without helmet", 1) & (conf > VIOLATION_CONF))
+    helmets = np.flatnonzero(_class_mask(cls, names, "with helmet", 0) & (conf > SUPPRESS_CONF))
+    if len(candidates) == 0 or len(helmets) == 0:
+        return candidates
+    suppressed = (iou_matrix(xyxy[candidates], xyxy[helmets]) > SUPPRESS_IOU).any(axis=1)
+    return candidates[~suppressed]
+
+def _box_arrays(result):
+    boxes = result.boxes
+    if len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32)
+    return (
+        boxes.xyxy.cpu().numpy().reshape(-1, 4),
+        boxes.cls.cpu().numpy().astype(int),
+        boxes.conf.cpu().numpy(),
+    )
+
+def collect_detections(frame, result, names):
+    """
+    Boxes, helmet violations and preprocessed plate crops of one ingested frame (plates not
+    read yet). YOLO ran on the frame's "yolo" view; boxes are reported in original-image
+    coordinates and plates are cropped from the "plate" view.
+    """
+    xyxy, cls, conf = _box_arrays(result)
+    to_original = frame.scale("yolo")
+    if to_original != 1:
+        xyxy = (xyxy * np.float32(to_original)).astype(np.float32)
+    bboxes = xyxy.tolist()
+    confs = conf.tolist()
+    labels = [names[c] for c in cls.tolist()]
+
+    violations = [
+        {"type": "No Helmet", "confidence": confs[i], "bbox": bboxes[i]}
+        for i in helmet_violations(xyxy, cls, conf, names).tolist()
+    ]
+
+    # 1: without helmet, 3: number plate (Assuming standard classes from user yaml)
+    plate_crops = []
+    plate_view = frame.views["plate"]
+    to_plate = 1 / frame.scale("plate")
+    for i in np.flatnonzero(_class_mask(cls, names, "number plate", 3)).tolist():
+        try:
+            plate_crops.append(_preprocess_plate(plate_view, [c * to_plate for c in bboxes[i]]))
+        except Exception as e:
+            logging.error(f"Plate preprocessing failed: {e}")
 
     return {
         "violation_detected": len(violations) > 0,
         "violations": violations,
+        "all_detections": [
+            {"label": label, "confidence": c, "bbox": bbox}
+            for label, c, bbox in zip(labels, confs, bboxes)
+        ]
+    }, plate_crops
+
+def finish_detections(partial, plate_texts):
+    plate_text = ""
+    for text_clean in plate_texts:
+        # Simple logic: the last plate that reads as more than 4 alphanumerics wins
+        if len(text_clean) > 4:
+            plate_text = text_clean
+    return {
+        "violation_detected": partial["violation_detected"],
+        "violations": partial["violations"],
         "license_plate": plate_text,
-        "all_detections": boxes_data
+        "all_detections": partial["all_detections"]
     }
+
+def analyze_detections(frame, result, names):
+    partial, crops = collect_detections(frame, result, names)
+    return finish_detections(partial, read_plates(crops))
+
+def detect_violation_memory(image_bytes):
+    current_model = load_model()
+    if not current_model:
+        return {"error": "Model not loaded"}
+
+    frame = decode_image(image_bytes)
+    if frame is None:
+        return {"error": "Invalid image data"}
+
+    result = _yolo_batcher.submit(frame.views["yolo"]).result()
+    return analyze_detections(frame, result, current_model.names)
+
+def _decode_frame(image_bytes):
+    # One oversized frame must not fail the whole burst
+    try:
+        return decode_image(image_bytes)
+    except image_ingest.ImageRejected as e:
+        return e
+
+def detect_violations_batch(images_bytes):
+    """Same per-image schema as detect_violation_memory, for a whole burst of frames."""
+    current_model = load_model()
+    if not current_model:
+        return [{"error": "Model not loaded"} for _ in images_bytes]
+
+    # cv2.imdecode releases the GIL, so frames decode in parallel
+    frames = list(_decode_pool.map(_decode_frame, images_bytes))
+    valid = [i for i, frame in enumerate(frames) if isinstance(frame, image_ingest.Ingested)]
+    detections = dict(zip(valid, run_yolo_batch([frames[i].views["yolo"] for i in valid])))
+
+    # Plates from every frame of the burst go through a single OCR pass
+    collected = {i: collect_detections(frames[i], detections[i], current_model.names) for i in valid}
+    crops = [crop for i in valid for crop in collected[i][1]]
+    texts = iter(read_plates(crops))
+
+    out = []
+    for i, frame in enumerate(frames):
+        if frame is None:
+            out.append({"error": "Invalid image data"})
+        elif isinstance(frame, image_ingest.ImageRejected):
+            out.append({"error": str(frame)})
+        else:
+            partial, frame_crops = collected[i]
+            out.append(finish_detections(partial, [next(texts) for _ in frame_crops]))
+    return out
@@ -0,0 +1,406 @@
+"""
+Offline duplicate clustering over the whole issues collection.
+
+    python duplicate_clusters.py --mongo-uri URI [--db NAME] [--workers N] [--full]
+
+1. Scan: streams every issue in chunks. Any embedding or pHash missing from the
+   feature store is computed on the way (see feature_store.py). A signature of
+   everything clustering depends on (text, status, category, location, date,
+   pHash and the clustering settings) is compared with the one stored at the
+   last run; a mismatch marks the issue as changed.
+2. Join: edges touching changed issues are dropped. Each changed issue is then
+   scored against the same-category issues in its own grid cell and the 8 cells
+   around it (cells are CLUSTER_RADIUS_KM wide), submitted within the time window.
+   The score is the one /detect-duplicates uses. Cells are scored on a process
+   pool, and pairs scoring at least CLUSTER_MIN_SCORE go into `duplicate_edges`.
+3. Cluster: union-find over all stored edges. Every issue in a group of two or
+   more gets `duplicate_cluster` set to the smallest issue id of its group.
+   Issues that have left their group have the field removed.
+
+An issue's new signature is only stored once its edges are written. An
+interrupted run therefore resumes on the next start: finished cells are not
+redone and stored features are reused. Unchanged issues are only read, never
+re-scored.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import UpdateOne
+
+import feature_store
+import geo_blocking
+import mongo
+import scoring
+
+logging.basicConfig(level=logging.INFO)
+
+EDGES_COLLECTION = 'duplicate_edges'
+RUNS_COLLECTION = 'duplicate_cluster_runs'
+# Pairs at or above this combined score are the same issue. Stricter than the 0.55
+# display cutoff of /detect-duplicates, since union-find chains every edge
+MIN_SCORE = float(os.environ.get("CLUSTER_MIN_SCORE", "0.85"))
+RADIUS_KM = float(os.environ.get("CLUSTER_RADIUS_KM", "0.5"))
+WORKERS = int(os.environ.get("CLUSTER_WORKERS", str(os.cpu_count() or 1)))
+# Changed issues scored per task
+TASK_ROWS = 1024
+# Pairs scored per task: the rest of the block is split into tiles of JOIN_TILE_PAIRS / task rows,
+# so a worker's scratch arrays stay under 100 MB however many issues share a block
+JOIN_TILE_PAIRS = 1 << 20
+PHASH_TOLERANCE = 30
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_ISSUE_FIELDS = {"title": 1, "description": 1, "status": 1, **geo_blocking.BLOCKING_FIELDS}
+
+
+def _settings_key():
+    import detect_duplicates_logic
+    return json.dumps([detect_duplicates_logic.MODEL_NAME, MIN_SCORE, RADIUS_KM,
+                       geo_blocking.WINDOW_DAYS, geo_blocking.SAME_CATEGORY])
+
+
+def _timestamp(value):
+    if not isinstance(value, datetime):
+        return math.nan
+    # pymongo returns naive UTC datetimes
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _signature(doc, image_hash, settings):
+    parts = [
+        feature_store.text_hash(feature_store.issue_text(doc)), doc.get('status'), doc.get('category'),
+        doc.get('location_lat'), doc.get('location_lng'), _timestamp(doc.get('submitted_at')), image_hash, settings,
+    ]
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class _Table:
+    """Compact per-issue metadata for every live (non-rejected) issue, in scan order."""
+
+    def __init__(self):
+        self.ids = []
+        self.category = []
+        self.lat = []
+        self.lng = []
+        self.time = []
+
+    def add(self, doc):
+        located = geo_blocking.has_location(doc)
+        self.ids.append(doc['_id'])
+        self.category.append(doc.get('category') if geo_blocking.SAME_CATEGORY else None)
+        self.lat.append(doc['location_lat'] if located else math.nan)
+        self.lng.append(doc['location_lng'] if located else math.nan)
+        self.time.append(_timestamp(doc.get('submitted_at')))
+
+    def freeze(self):
+        self.lat = np.array(self.lat, dtype=np.float64)
+        self.lng = np.array(self.lng, dtype=np.float64)
+        self.time = np.array(self.time, dtype=np.float64)
+
+
+def scan(db, full=False):
+    """
+    Pass 1. Returns (table of live issues, {changed issue id: new signature}).
+    Rejected issues whose signature changed are included in the changes.
+    """
+    import detect_duplicates_logic
+
+    collection = db['issues']
+    features = feature_store.get_features_collection(db)
+    loader = detect_duplicates_logic._image_loader(collection)
+    settings = _settings_key()
+    table = _Table()
+    changed = {}
+    for batch in mongo.iter_batches(collection.find({}, _ISSUE_FIELDS).sort("_id", 1)):
+        ids = [row['_id'] for row in batch]
+        feature_store.get_text_embeddings(db, batch, detect_duplicates_logic.encode_texts, detect_duplicates_logic.MODEL_NAME)
+        hashes = feature_store.get_image_hashes(db, ids, loader, detect_duplicates_logic.get_image_phashes)
+        stored = {} if full else {
+            row['_id']: row.get('cluster_sig') for row in features.find({"_id": {"$in": ids}}, {"cluster_sig": 1})
+        }
+        for row in batch:
+            sig = _signature(row, hashes.get(row['_id']), settings)
+            if stored.get(row['_id']) != sig:
+                changed[row['_id']] = sig
+            if row.get('status') != "Rejected":
+                table.add(row)
+    table.freeze()
+    logging.info(f"Scanned {len(table.ids)} live issues, {len(changed)} changed since the last run.")
+    return table, changed
+
+
+def _grid(table):
+    """{(category, cell): [row indices]}; cell is (lat row, lng column), or None without coordinates."""
+    dlat = math.degrees(RADIUS_KM / geo_blocking.EARTH_RADIUS_KM)
+    located = ~np.isnan(table.lat)
+    # One column width for the whole run, wide enough at the most poleward issue
+    max_lat = float(np.abs(table.lat[located]).max()) if located.any() else 0.0
+    dlng = dlat / max(math.cos(math.radians(min(max_lat, 89.0))), 1e-6)
+    rows = np.where(located, np.floor(np.nan_to_num(table.lat) / dlat), 0).astype(np.int64)
+    cols = np.where(located, np.floor(np.nan_to_num(table.lng) / dlng), 0).astype(np.int64)
+    cells = defaultdict(list)
+    for i in range(len(table.ids)):
+        cell = (int(rows[i]), int(cols[i])) if located[i] else None
+        cells[(table.category[i], cell)].append(i)
+    return cells
+
+
+def _load_features(db, ids):
+    """(unit-normalized embeddings, (n, 4) uint64 pHash words, has-hash mask) for `ids`, in order."""
+    rows = {row['_id']: row for row in feature_store.get_features_collection(db).find(
+        {"_id": {"$in": ids}}, {"embedding": 1, "phash": 1})}
+    vecs = np.zeros((len(ids), feature_store.EMBEDDING_DIM), dtype=np.float32)
+    hashes = np.zeros((len(ids), 4), dtype=np.uint64)
+    has_hash = np.zeros(len(ids), dtype=bool)
+    for i, issue_id in enumerate(ids):
+        row = rows.get(issue_id) or {}
+        if row.get('embedding'):
+            vecs[i] = feature_store._unpack(row['embedding'])
+        if row.get('phash'):
+            hashes[i] = np.array(row['phash'], dtype=np.int64).view(np.uint64)
+            has_hash[i] = True
+    return scoring.normalize_rows(vecs), hashes, has_hash
+
+
+def join_block(home, others, radius_km, window_s, min_score):
+    """
+    All pairs between `home` and `others` scoring at least `min_score`, as
+    [(home id, other id, score)]. Each side is a dict of equal-length arrays:
+    ids, vecs (unit rows), hashes ((n, 4) uint64), has_hash, lat, lng, time.
+    Runs in a worker process.
+    """
+    text = np.maximum(home["vecs"] @ others["vecs"].T, 0.0)
+
+    # One 64-bit word at a time, so the scratch is 8 bytes per pair rather than 32
+    dist = np.zeros(text.shape, dtype=np.uint16)
+    for w in range(home["hashes"].shape[1]):
+        xor = home["hashes"][:, w, None] ^ others["hashes"][None, :, w]
+        dist += _POPCOUNT[xor[..., None].view(np.uint8)].sum(axis=-1, dtype=np.uint16)
+    image = np.where(dist > PHASH_TOLERANCE, 0.0, 1.0 - dist / float(PHASH_TOLERANCE))
+    image[~(home["has_hash"][:, None] & others["has_hash"][None, :])] = 0.0
+
+    final = scoring.combine_scores(text, image)
+    keep = final >= min_score
+    keep &= home["ids"][:, None] != others["ids"][None, :]
+    both_located = ~np.isnan(home["lat"])[:, None] & ~np.isnan(others["lat"])[None, :]
+    if both_located.any():
+        near = np.zeros_like(keep)
+        for i in np.flatnonzero(both_located.any(axis=1)):
+            near[i] = geo_blocking.haversine_km(home["lat"][i], home["lng"][i], others["lat"], others["lng"]) <= radius_km
+        keep &= ~both_located | near
+    if window_s:
+        dt = np.abs(home["time"][:, None] - others["time"][None, :])
+        keep &= ~(dt > window_s)  # NaN (no date) never excludes a pair
+
+    return [(home["ids"][i], others["ids"][j], float(final[i, j])) for i, j in zip(*np.nonzero(keep))]
+
+
+def _side(table, rows, features):
+    vecs, hashes, has_hash = features
+    return {
+        "ids": np.array([table.ids[i] for i in rows], dtype=object),
+        "vecs": vecs, "hashes": hashes, "has_hash": has_hash,
+        "lat": table.lat[rows], "lng": table.lng[rows], "time": table.time[rows],
+    }
+
+
+def _tasks(db, table, changed_rows):
+    """
+    Yields (chunk number, tiles in the chunk, home side, others side, home ids). Each
+    block's changed issues are split into chunks of TASK_ROWS, and the block into tiles
+    of at most JOIN_TILE_PAIRS pairs per chunk. Blocks are visited in grid order so
+    features are loaded about once per cell.
+    """
+    cells = _grid(table)
+    homes = defaultdict(list)
+    for (category, cell), rows in cells.items():
+        dirty = [i for i in rows if i in changed_rows]
+        if dirty:
+            homes[(category, cell)] = dirty
+    cache = {}
+    chunk_no = 0
+    order = sorted(homes, key=lambda k: (str(k[0]), k[1] is None, k[1] or (0, 0)))
+    for category, cell in order:
+        if cell is not None:
+            # Cells two or more rows behind are never needed again
+            cache = {k: v for k, v in cache.items() if k[0] == category and k[1] is not None and k[1][0] >= cell[0] - 1}
+            parts = []
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    key = (category, (cell[0] + dr, cell[1] + dc))
+                    if key in cells:
+                        if key not in cache:
+                            cache[key] = _load_features(db, [table.ids[i] for i in cells[key]])
+                        parts.append((cells[key], cache[key]))
+            rows = [i for part, _ in parts for i in part]
+            features = tuple(np.concatenate([f[k] for _, f in parts]) for k in range(3))
+        else:
+            cache = {}
+            # Issues without coordinates are compared with each other, per category
+            rows = cells[(category, None)]
+            features = _load_features(db, [table.ids[i] for i in rows])
+        position = {i: p for p, i in enumerate(rows)}
+        dirty = homes[(category, cell)]
+        for start in range(0, len(dirty), TASK_ROWS):
+            chunk = dirty[start:start + TASK_ROWS]
+            picks = [position[i] for i in chunk]
+            home = _side(table, chunk, tuple(f[picks] for f in features))
+            tile = max(1, JOIN_TILE_PAIRS // len(chunk))
+            tiles = range(0, len(rows), tile)
+            chunk_no += 1
+            for t in tiles:
+                others = _side(table, rows[t:t + tile], tuple(f[t:t + tile] for f in features))
+                yield chunk_no, len(tiles), home, others, [table.ids[i] for i in chunk]
+
+
+def _write_edges(db, edges):
+    ops = []
+    for a, b, score in edges:
+        a, b = sorted((a, b))
+        ops.append(UpdateOne({"_id": f"{a}|{b}"}, {"$set": {"a": a, "b": b, "score": round(score, 4)}}, upsert=True))
+    if ops:
+        db[EDGES_COLLECTION].bulk_write(ops, ordered=False)
+
+
+def _commit_signatures(db, changed, ids):
+    ops = [UpdateOne({"_id": i}, {"$set": {"cluster_sig": changed[i]}}, upsert=True) for i in ids]
+    if ops:
+        feature_store.get_features_collection(db).bulk_write(ops, ordered=False)
+
+
+def join(db, table, changed, workers=WORKERS):
+    """Pass 2. Rescores every changed live issue against its block and stores the new edges."""
+    edges = db[EDGES_COLLECTION]
+    changed_ids = list(changed)
+    for start in range(0, len(changed_ids), 10_000):
+        part = changed_ids[start:start + 10_000]
+        edges.delete_many({"$or": [{"a": {"$in": part}}, {"b": {"$in": part}}]})
+    live = set(table.ids)
+    # Rejected issues only needed their edges removed
+    _commit_signatures(db, changed, [i for i in changed_ids if i not in live])
+
+    changed_rows = {i for i, issue_id in enumerate(table.ids) if issue_id in changed}
+    window_s = geo_blocking.WINDOW_DAYS * 86400
+    args = (RADIUS_KM, window_s, MIN_SCORE)
+    found = 0
+    remaining = {}  # chunk number -> tiles not yet written
+
+    def finish(result, chunk_no, tiles, home_ids):
+        nonlocal found
+        _write_edges(db, result)
+        found += len(result)
+        left = remaining.pop(chunk_no, tiles) - 1
+        if left:
+            remaining[chunk_no] = left
+        else:
+            # Only once every tile of the chunk has its edges stored
+            _commit_signatures(db, changed, home_ids)
+
+    if workers <= 1:
+        for chunk_no, tiles, home, others, home_ids in _tasks(db, table, changed_rows):
+            finish(join_block(home, others, *args), chunk_no, tiles, home_ids)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for chunk_no, tiles, home, others, home_ids in _tasks(db, table, changed_rows):
+                pending[pool.submit(join_block, home, others, *args)] = (chunk_no, tiles, home_ids)
+                # Bounded in flight, so loaded features do not pile up ahead of the workers
+                while len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future.result(), *pending.pop(future))
+            for future in list(pending):
+                finish(future.result(), *pending.pop(future))
+    logging.info(f"Scored {len(changed_rows)} changed issues, {found} duplicate pairs (both directions).")
+
+
+def _find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def cluster(db, table):
+    """Pass 3. Union-find over all stored edges; writes `duplicate_cluster` on the issues that changed group."""
+    live = set(table.ids)
+    parent = {}
+    stale = []
+    for edge in mongo.iter_batches(db[EDGES_COLLECTION].find({}, {"a": 1, "b": 1})):
+        for row in edge:
+            a, b = row['a'], row['b']
+            if a not in live or b not in live:
+                stale.append(row['_id'])  # an endpoint was deleted
+                continue
+            parent.setdefault(a, a)
+            parent.setdefault(b, b)
+            ra, rb = _find(parent, a), _find(parent, b)
+            if ra != rb:
+                # The smaller id is the root, so a cluster's id is its smallest member
+                parent[max(ra, rb)] = min(ra, rb)
+    if stale:
+        db[EDGES_COLLECTION].delete_many({"_id": {"$in": stale}})
+
+    wanted = {issue_id: _find(parent, issue_id) for issue_id in parent}
+    issues = db['issues']
+    ops = []
+    for row in issues.find({"duplicate_cluster": {"$exists": True}}, {"duplicate_cluster": 1}):
+        cluster_id = wanted.pop(row['_id'], None)
+        if cluster_id is None:
+            ops.append(UpdateOne({"_id": row['_id']}, {"$unset": {"duplicate_cluster": ""}}))
+        elif cluster_id != row['duplicate_cluster']:
+            ops.append(UpdateOne({"_id": row['_id']}, {"$set": {"duplicate_cluster": cluster_id}}))
+    for issue_id, cluster_id in wanted.items():
+        ops.append(UpdateOne({"_id": issue_id}, {"$set": {"duplicate_cluster": cluster_id}}))
+    for start in range(0, len(ops), mongo.CURSOR_BATCH_SIZE):
+        issues.bulk_write(ops[start:start + mongo.CURSOR_BATCH_SIZE], ordered=False)
+    clusters = len({_find(parent, x) for x in parent})
+    logging.info(f"{clusters} duplicate clusters over {len(parent)} issues; {len(ops)} issues updated.")
+    return {"clusters": clusters, "clustered_issues": len(parent), "issues_updated": len(ops)}
+
+
+def run(mongo_uri, db_name=None, full=False, workers=WORKERS):
+    """Runs all three passes and records the run in `duplicate_cluster_runs`."""
+    db = mongo.get_database(mongo_uri, db_name)
+    started = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    if full:
+        db[EDGES_COLLECTION].delete_many({})
+    table, changed = scan(db, full)
+    t1 = time.perf_counter()
+    join(db, table, changed, workers)
+    t2 = time.perf_counter()
+    stats = cluster(db, table)
+    t3 = time.perf_counter()
+    stats.update({
+        "issues": len(table.ids),
+        "changed": len(changed),
+        "full": full,
+        "scan_s": round(t1 - t0, 2),
+        "join_s": round(t2 - t1, 2),
+        "cluster_s": round(t3 - t2, 2),
+    })
+    db[RUNS_COLLECTION].insert_one({"started_at": started, "finished_at": datetime.now(timezone.utc), **stats})
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGODB_URI"), required="MONGODB_URI" not in os.environ)
+    parser.add_argument("--db", help="Database name (default: the one in the URI)")
+    parser.add_argument("--full", action="store_true", help="Rescore every issue instead of only changed ones")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Processes scoring blocks (1 = inline)")
+    args = parser.parse_args()
+    print(json.dumps(run(args.mongo_uri, args.db, args.full, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
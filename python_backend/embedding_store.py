@@ -0,0 +1,354 @@
+"""
+On-disk, memory-mapped embedding matrix shared by every backend process.
+
+With DUPLICATE_INDEX=mmap, the duplicate ANN index lives in EMBEDDING_STORE_DIR
+instead of each uvicorn worker's heap. Every process maps the same files
+read-only, so the OS page cache holds one copy however many workers there are.
+
+Files of generation g:
+    g.f32    float32 unit rows, only touched to rescore the short list exactly
+    g.q      quantized rows that are scanned on every query: sign bits (EMBEDDING_STORE_QUANT=binary,
+             48 B per row, Hamming distance) or int8 (384 B per row plus a float32 scale in g.scale)
+    g.ids    issue ids as fixed-width bytes; rows below meta["sorted"] are in id order
+    g.dead   int64 row numbers of removed or replaced rows
+    meta.json  generation, committed row count, dead count (replaced atomically)
+
+Adds append a row and tombstone the old one; readers pick new rows up on their
+next search. compact() rewrites the live rows in id order into the next
+generation, which keeps the id -> row lookup a binary search over the mapped
+ids plus a small in-memory dict for rows appended since. Compaction runs
+automatically once the unsorted tail or the dead rows grow past their limits,
+or on demand with `python embedding_store.py compact DIR`.
+
+Writers (add/remove/compact) hold an exclusive flock, so any process may write.
+Issue ids are stored as strings.
+"""
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+import scoring
+
+STORE_DIR = os.environ.get("EMBEDDING_STORE_DIR", "")
+QUANT = os.environ.get("EMBEDDING_STORE_QUANT", "binary")  # "binary" or "int8"
+# Rows rescored exactly per requested neighbour
+RESCORE_FACTOR = int(os.environ.get("EMBEDDING_STORE_RESCORE", "10"))
+# Compact once this many rows were appended since the last compaction (0 = never automatically)...
+COMPACT_TAIL = int(os.environ.get("EMBEDDING_STORE_COMPACT_TAIL", "50000"))
+# ...or this share of all rows is dead
+COMPACT_DEAD_RATIO = 0.2
+ID_BYTES = 48
+SCAN_ROWS = 8192
+
+
+def quantize(vecs, quant):
+    """(quantized rows, per-row float32 scale or None) for unit rows `vecs`."""
+    if quant == "binary":
+        return np.packbits(vecs > 0, axis=1), None
+    peak = np.abs(vecs).max(axis=1, keepdims=True)
+    peak[peak == 0] = 1.0
+    q = np.round(vecs * (127.0 / peak)).astype(np.int8)
+    return q, (peak[:, 0] / 127.0).astype(np.float32)
+
+
+def _popcount(words):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return np.unpackbits(words.view(np.uint8), axis=1).sum(axis=1, dtype=np.int32)
+
+
+class MappedIndex:
+    """
+    Drop-in for ann_index.FlatIndex (`add`, `remove`, `search`, `__len__`,
+    `__contains__`) backed by the shared files in `path`.
+    """
+
+    persistent = True
+
+    def __init__(self, path, dim=384, quant=QUANT, rescore_factor=RESCORE_FACTOR,
+                 compact_tail=COMPACT_TAIL):
+        self.path = path
+        self.dim = dim
+        self.rescore_factor = rescore_factor
+        self.compact_tail = compact_tail
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(path, "lock"), "a+")
+        self._lock_depth = 0
+        self._stamp = None
+        with self._writing():
+            if not os.path.exists(self._meta_path()):
+                self._write_meta({"dim": dim, "quant": quant, "generation": 0, "rows": 0, "dead": 0, "sorted": 0})
+        self._refresh()
+        if self.meta["dim"] != dim:
+            raise ValueError(f"Embedding store at {path} holds {self.meta['dim']}-d vectors, not {dim}-d")
+
+    # --- files ---
+
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _file(self, ext, generation=None):
+        return os.path.join(self.path, f"{self.meta['generation'] if generation is None else generation}.{ext}")
+
+    def _write_meta(self, meta):
+        tmp = self._meta_path() + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path())
+
+    @property
+    def quant(self):
+        return self.meta["quant"]
+
+    def _qwidth(self, quant=None):
+        return self.dim // 8 if (quant or self.quant) == "binary" else self.dim
+
+    def _map(self, ext, generation, dtype, count, width=None, random_access=False):
+        shape = (count,) if width is None else (count, width)
+        if count == 0:
+            return np.zeros(shape, dtype=dtype)
+        mapped = np.memmap(self._file(ext, generation), dtype=dtype, mode="r", shape=shape)
+        if random_access and hasattr(mmap, "MADV_RANDOM"):
+            # Rescoring reads a few scattered rows; readahead would pull in (and count) whole stretches
+            mapped._mmap.madvise(mmap.MADV_RANDOM)
+        return mapped
+
+    def _refresh(self):
+        """
+        Picks up changes made by another process (or this one) since the last call. Rows
+        and tombstones added within the current generation are applied incrementally; the
+        files are only reopened from scratch after a compaction moved the generation.
+        """
+        try:
+            st = os.stat(self._meta_path())
+        except FileNotFoundError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return
+        for _ in range(3):
+            with open(self._meta_path()) as f:
+                meta = json.load(f)
+            try:
+                self._open_generation(meta)
+                self._stamp = stamp
+                return
+            except FileNotFoundError:
+                # A compaction swapped generations between reading meta and opening the files
+                st = os.stat(self._meta_path())
+                stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        raise RuntimeError(f"Embedding store at {self.path} keeps changing under the reader")
+
+    def _open_generation(self, meta):
+        opened = getattr(self, "meta", None)
+        grown = (opened is not None and meta["generation"] == opened["generation"] and meta["sorted"] == opened["sorted"]
+                 and meta["rows"] >= opened["rows"] and meta["dead"] >= opened["dead"])
+        first_row, first_dead = (opened["rows"], opened["dead"]) if grown else (0, 0)
+        n = meta["rows"]
+        # Maps and tombstones are read before any state changes, so a vanished file leaves it intact
+        g = meta["generation"]
+        vecs = self._map("f32", g, np.float32, n, self.dim, random_access=True)
+        q = self._map("q", g, np.uint8 if meta["quant"] == "binary" else np.int8, n, self._qwidth(meta["quant"]))
+        scales = self._map("scale", g, np.float32, n) if meta["quant"] == "int8" else None
+        ids = self._map("ids", g, f"S{ID_BYTES}", n)
+        dead_rows = np.zeros(0, dtype=np.int64)
+        if meta["dead"] > first_dead:
+            dead_rows = np.fromfile(self._file("dead", g), dtype=np.int64, count=meta["dead"] - first_dead, offset=first_dead * 8)
+
+        if not grown:
+            self._dead_buf = np.zeros(n, dtype=bool)
+            self._dead_count = 0
+            self._tail = {}
+        elif n > len(self._dead_buf):
+            # Grown geometrically, so a run of single-row adds does not copy the mask each time
+            buf = np.zeros(max(n, 2 * len(self._dead_buf)), dtype=bool)
+            buf[:first_row] = self._dead_buf[:first_row]
+            self._dead_buf = buf
+        self.meta, self.vecs, self.q, self.scales, self.ids = meta, vecs, q, scales, ids
+        self.dead = self._dead_buf[:n]
+        dead_rows = np.unique(dead_rows)
+        self._dead_count += int(np.count_nonzero(~self.dead[dead_rows]))
+        self.dead[dead_rows] = True
+        # Rows appended since the last compaction; later rows replace earlier ones
+        for row in range(max(first_row, meta["sorted"]), n):
+            self._tail[bytes(ids[row])] = row
+        self._live = n - self._dead_count
+
+    # --- locking ---
+
+    @contextmanager
+    def _writing(self):
+        import fcntl
+
+        with self._lock:
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    # --- lookups ---
+
+    @staticmethod
+    def _key(issue_id):
+        key = str(issue_id).encode()
+        if len(key) > ID_BYTES:
+            raise ValueError(f"Issue id longer than {ID_BYTES} bytes: {issue_id!r}")
+        return key
+
+    def _row(self, key):
+        """Live row of `key`, or None."""
+        row = self._tail.get(key)
+        if row is None:
+            sorted_ids = self.ids[:self.meta["sorted"]]
+            i = int(np.searchsorted(sorted_ids, key))
+            if i < len(sorted_ids) and sorted_ids[i] == key:
+                row = i
+        return None if row is None or self.dead[row] else row
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._live
+
+    def __contains__(self, issue_id):
+        with self._lock:
+            self._refresh()
+            return self._row(self._key(issue_id)) is not None
+
+    # --- writes ---
+
+    def add(self, issue_id, vec):
+        """Inserts or replaces the vector for `issue_id`."""
+        self.add_many([issue_id], np.asarray(vec, dtype=np.float32).reshape(1, -1))
+
+    def add_many(self, issue_ids, vecs):
+        """Appends many rows with one metadata update (index builds use this)."""
+        keys = [self._key(i) for i in issue_ids]
+        if not keys:
+            return
+        vecs = scoring.normalize_rows(vecs)
+        with self._writing():
+            self._refresh()
+            # Repeated ids within the batch: only the last copy stays live
+            last = {k: i for i, k in enumerate(keys)}
+            replaced = [row for row in (self._row(k) for k in last) if row is not None]
+            start = self.meta["rows"]
+            replaced += [start + i for i, k in enumerate(keys) if last[k] != i]
+            q, scales = quantize(vecs, self.quant)
+            with open(self._file("f32"), "ab") as f:
+                f.write(vecs.tobytes())
+            with open(self._file("q"), "ab") as f:
+                f.write(np.ascontiguousarray(q).tobytes())
+            if scales is not None:
+                with open(self._file("scale"), "ab") as f:
+                    f.write(scales.tobytes())
+            with open(self._file("ids"), "ab") as f:
+                f.write(np.array(keys, dtype=f"S{ID_BYTES}").tobytes())
+            self._commit(len(keys), replaced)
+
+    def remove(self, issue_id):
+        with self._writing():
+            self._refresh()
+            row = self._row(self._key(issue_id))
+            if row is not None:
+                self._commit(0, [row])
+
+    def _commit(self, appended, dead_rows):
+        # Data first, then meta: readers never see a row count beyond what is on disk
+        if dead_rows:
+            with open(self._file("dead"), "ab") as f:
+                f.write(np.array(dead_rows, dtype=np.int64).tobytes())
+        meta = dict(self.meta, rows=self.meta["rows"] + appended, dead=self.meta["dead"] + len(dead_rows))
+        self._write_meta(meta)
+        self._refresh()
+        tail = meta["rows"] - meta["sorted"]
+        if (self.compact_tail and tail >= self.compact_tail) or meta["dead"] > COMPACT_DEAD_RATIO * max(meta["rows"], 1):
+            self.compact()
+
+    def compact(self):
+        """Rewrites the live rows, sorted by id, as the next generation and drops the old one."""
+        with self._writing():
+            self._refresh()
+            old = self.meta["generation"]
+            live = np.flatnonzero(~self.dead)
+            live = live[np.argsort(self.ids[live], kind="stable")]
+            new = old + 1
+            exts = ["f32", "q", "ids"] + (["scale"] if self.quant == "int8" else [])
+            sources = {"f32": self.vecs, "q": self.q, "ids": self.ids, "scale": self.scales}
+            for ext in exts:
+                with open(self._file(ext, new), "wb") as f:
+                    for s in range(0, len(live), 65536):
+                        f.write(np.ascontiguousarray(sources[ext][live[s:s + 65536]]).tobytes())
+            meta = dict(self.meta, generation=new, rows=len(live), dead=0, sorted=len(live))
+            self._write_meta(meta)
+            self._refresh()
+            # Processes still mapping the old files keep reading them until they remap
+            for ext in exts + ["dead"]:
+                try:
+                    os.remove(self._file(ext, old))
+                except FileNotFoundError:
+                    pass
+            logging.info(f"Compacted embedding store: {len(live)} live rows (generation {new}).")
+
+    # --- search ---
+
+    def _coarse_scores(self, query):
+        n = self.meta["rows"]
+        scores = np.empty(n, dtype=np.float32)
+        if self.quant == "binary":
+            bits = np.packbits(query > 0)
+            words = np.ascontiguousarray(self.q).view(np.uint64) if n else None
+            qwords = bits.view(np.uint64)
+            for s in range(0, n, SCAN_ROWS):
+                scores[s:s + SCAN_ROWS] = -_popcount(words[s:s + SCAN_ROWS] ^ qwords)
+        else:
+            for s in range(0, n, SCAN_ROWS):
+                chunk = self.q[s:s + SCAN_ROWS].astype(np.float32)
+                scores[s:s + SCAN_ROWS] = (chunk @ query) * self.scales[s:s + SCAN_ROWS]
+        return scores
+
+    def search(self, vec, k=10, exclude=None):
+        """Returns up to `k` (issue_id, cosine score) pairs, best first; scores are exact float32."""
+        query = scoring.normalize_rows(vec)[0]
+        with self._lock:
+            self._refresh()
+            if self._live == 0:
+                return []
+            coarse = self._coarse_scores(query)
+            coarse[self.dead] = -np.inf
+            if exclude is not None:
+                row = self._row(self._key(exclude))
+                if row is not None:
+                    coarse[row] = -np.inf
+            shortlist = min(len(coarse), max(k, k * self.rescore_factor))
+            rows = np.argpartition(-coarse, shortlist - 1)[:shortlist]
+            rows = np.sort(rows[coarse[rows] != -np.inf])  # ascending rows read the float file in order
+            exact = self.vecs[rows] @ query
+            best = np.argsort(-exact, kind="stable")[:k]
+            return [(self.ids[rows[i]].decode(), float(exact[i])) for i in best]
+
+
+def open_store(name, dim=384):
+    """The store for `name` (one per database) under EMBEDDING_STORE_DIR."""
+    if not STORE_DIR:
+        raise ValueError("DUPLICATE_INDEX=mmap needs EMBEDDING_STORE_DIR")
+    return MappedIndex(os.path.join(STORE_DIR, name), dim)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "compact":
+        sys.exit("Usage: python embedding_store.py compact DIR")
+    logging.basicConfig(level=logging.INFO)
+    MappedIndex(sys.argv[2]).compact()
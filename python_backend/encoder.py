@@ -0,0 +1,47 @@
+"""
+Sentence embedding service.
+
+Every text encode in the backend goes through one MicroBatcher, so concurrent
+requests and bulk backfills share batched `SentenceTransformer.encode` calls
+instead of encoding one sentence at a time.
+"""
+import os
+
+import numpy as np
+
+import model_registry
+from batching import MicroBatcher
+
+MODEL_NAME = model_registry.SENTENCE_MODEL_NAME
+EMBEDDING_DIM = 384
+ENCODE_BATCH_SIZE = int(os.environ.get("ENCODE_BATCH_SIZE", "64"))
+ENCODE_MAX_WAIT_MS = float(os.environ.get("ENCODE_MAX_WAIT_MS", "5"))
+
+
+def get_model():
+    return model_registry.get("sentence")
+
+
+def _encode_batch(texts):
+    vectors = get_model().encode(texts, batch_size=len(texts))
+    return list(np.asarray(vectors, dtype=np.float32))
+
+
+_batcher = MicroBatcher(_encode_batch, ENCODE_BATCH_SIZE, ENCODE_MAX_WAIT_MS, name="sentence-encoder")
+
+
+def encode_async(text):
+    """Future resolving to the float32 embedding of `text`."""
+    return _batcher.submit(text)
+
+
+def encode(text):
+    return _batcher.submit(text).result()
+
+
+def encode_many(texts):
+    """(len(texts), 384) float32 matrix; large lists are split into full batches."""
+    futures = _batcher.submit_many(texts)
+    if not futures:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    return np.vstack([f.result() for f in futures])
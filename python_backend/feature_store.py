@@ -0,0 +1,193 @@
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+from bson.binary import Binary
+from pymongo import UpdateOne
+
+# Precomputed per-issue features live next to the issues, one document per issue:
+# { _id: <issue id>, text_hash, text_model, embedding (float32 bytes),
+#   phash (256-bit pHash as 4 int64 words, null if no usable image), phash_checked,
+#   phash_source (image_digest of the reference it was computed from), updated_at }
+FEATURES_COLLECTION = 'issue_features'
+EMBEDDING_DIM = 384
+
+
+def issue_text(doc):
+    return (doc.get('title', "") or "") + ". " + (doc.get('description', "") or "")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# Everything precomputed duplicate matches depend on (see source_signature)
+SOURCE_FIELDS = {"title": 1, "description": 1, "status": 1, "category": 1, "location_lat": 1, "location_lng": 1,
+                 "submitted_at": 1, "imageUrl": 1, "image_url": 1}
+
+
+# Issue fields holding the image reference
+IMAGE_FIELDS = {"imageUrl": 1, "image_url": 1}
+
+
+def reference_digest(image):
+    """SHA-256 of an image reference (URL or data URI); None without an image."""
+    return hashlib.sha256(image.encode('utf-8')).hexdigest() if isinstance(image, str) and image else None
+
+
+def image_digest(doc):
+    """SHA-256 of the issue's image reference; None without an image."""
+    return reference_digest(doc.get('imageUrl') or doc.get('image_url'))
+
+
+def source_signature(doc, model_name):
+    """Changes whenever an edit could change the issue's duplicate matches."""
+    parts = [text_hash(issue_text(doc)), image_digest(doc), model_name] + [
+        str(doc.get(field)) for field in ("status", "category", "location_lat", "location_lng", "submitted_at")
+    ]
+    return text_hash("|".join(str(p) for p in parts))
+
+
+def _pack(vec):
+    return Binary(np.asarray(vec, dtype=np.float32).tobytes())
+
+
+def _unpack(blob):
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def get_features_collection(db):
+    return db[FEATURES_COLLECTION]
+
+
+def get_text_embeddings(db, issues, encode, model_name):
+    """
+    Returns {issue_id: float32 vector} for every issue in `issues`.
+    Embeddings are reused when the stored text hash and model name still match,
+    otherwise the missing ones are encoded in a single batch and written back.
+    """
+    features = get_features_collection(db)
+    wanted = {}
+    for doc in issues:
+        text = issue_text(doc)
+        wanted[doc['_id']] = (text, text_hash(text))
+
+    out = {}
+    if not wanted:
+        return out
+
+    stored = features.find(
+        {"_id": {"$in": list(wanted.keys())}},
+        {"text_hash": 1, "text_model": 1, "embedding": 1}
+    )
+    for row in stored:
+        _, h = wanted[row['_id']]
+        if row.get('text_hash') == h and row.get('text_model') == model_name and row.get('embedding'):
+            out[row['_id']] = _unpack(row['embedding'])
+
+    missing = [issue_id for issue_id in wanted if issue_id not in out]
+    if not missing:
+        return out
+
+    logging.info(f"Encoding {len(missing)} issue embeddings ({len(out)} cached).")
+    texts = [wanted[issue_id][0] for issue_id in missing]
+    # Empty text keeps the historical zero-vector embedding
+    to_encode = [i for i, t in enumerate(texts) if t.strip()]
+    vectors = np.zeros((len(missing), EMBEDDING_DIM), dtype=np.float32)
+    if to_encode:
+        encoded = encode([texts[i] for i in to_encode])
+        vectors[to_encode] = np.asarray(encoded, dtype=np.float32)
+
+    now = datetime.now(timezone.utc)
+    ops = []
+    for issue_id, vec in zip(missing, vectors):
+        out[issue_id] = vec
+        ops.append(UpdateOne(
+            {"_id": issue_id},
+            {"$set": {
+                "text_hash": wanted[issue_id][1],
+                "text_model": model_name,
+                "embedding": _pack(vec),
+                "updated_at": now,
+            }},
+            upsert=True
+        ))
+    try:
+        features.bulk_write(ops, ordered=False)
+    except Exception as e:
+        # The store is an optimisation, a failed write only costs a re-encode later
+        logging.error(f"Failed to persist embeddings: {e}")
+    return out
+
+
+def pack_hash(value):
+    """256-bit int -> four signed 64-bit words (BSON has no unsigned/bigint type)."""
+    words = []
+    for shift in (192, 128, 64, 0):
+        w = (value >> shift) & 0xFFFFFFFFFFFFFFFF
+        words.append(w - (1 << 64) if w >= (1 << 63) else w)
+    return words
+
+
+def unpack_hash(words):
+    value = 0
+    for w in words:
+        value = (value << 64) | (w & 0xFFFFFFFFFFFFFFFF)
+    return value
+
+
+def get_image_hashes(db, issue_ids, load_images, compute_hashes, refresh=False, digests=None):
+    """
+    Returns {issue_id: 256-bit pHash int or None} for `issue_ids`.
+    Stored hashes are reused; image bytes are only loaded (via
+    `load_images(ids) -> {id: image}`) for issues that were never hashed,
+    or for every issue when `refresh` is set (e.g. after an edit).
+    `digests` ({id: image_digest of the current reference}) also recomputes hashes
+    made from another image; without it, stored hashes are trusted.
+    `compute_hashes({id: image}) -> {id: hash}` hashes all missing images in one go.
+    """
+    features = get_features_collection(db)
+    out = {}
+    ids = list(issue_ids)
+    if not ids:
+        return out
+
+    if not refresh:
+        for row in features.find({"_id": {"$in": ids}, "phash_checked": True}, {"phash": 1, "phash_source": 1}):
+            if digests is not None and row['_id'] in digests and row.get('phash_source') != digests[row['_id']]:
+                continue  # the issue's image was replaced
+            out[row['_id']] = unpack_hash(row['phash']) if row.get('phash') else None
+
+    missing = [issue_id for issue_id in ids if issue_id not in out]
+    if not missing:
+        return out
+
+    logging.info(f"Hashing {len(missing)} issue images ({len(out)} cached).")
+    images = load_images(missing)
+    hashes = compute_hashes({issue_id: image for issue_id, image in images.items() if image})
+    now = datetime.now(timezone.utc)
+    ops = []
+    for issue_id in missing:
+        image = images.get(issue_id)
+        h = hashes.get(issue_id)
+        out[issue_id] = h
+        if image and h is None:
+            # Undecodable or unreachable right now: retry on a later call instead of caching the miss
+            continue
+        ops.append(UpdateOne(
+            {"_id": issue_id},
+            {"$set": {
+                "phash": pack_hash(h) if h is not None else None,
+                "phash_checked": True,
+                "phash_source": reference_digest(image),
+                "updated_at": now,
+            }},
+            upsert=True
+        ))
+    try:
+        if ops:
+            features.bulk_write(ops, ordered=False)
+    except Exception as e:
+        logging.error(f"Failed to persist image hashes: {e}")
+    return out
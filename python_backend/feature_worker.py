@@ -0,0 +1,248 @@
+"""
+Background precomputation of duplicate features and matches.
+
+    python feature_worker.py --mongo-uri URI [--db NAME] [--mode auto|stream|poll]
+
+Follows changes to `issues` and, for every new or edited issue, stores its
+embedding and pHash, updates the duplicate indexes and saves its candidate
+matches in `issue_features`. `/detect-duplicates` then reads them
+(`detect_duplicates_logic.precomputed_matches`) instead of scoring on demand.
+
+- stream: a MongoDB change stream (replica sets only). The resume token is saved
+  after each processed batch, so a restart continues after the last finished batch.
+- poll: for standalone servers. Issues are read in (updated_at, _id) order, and in
+  (submitted_at, _id) order for those never updated, from the saved watermarks.
+  Deletes are not visible here; deleted matches are dropped when read.
+- auto (default): stream, falling back to poll when change streams are unavailable.
+  When the saved resume token has left the oplog, a new stream is opened and one
+  poll catches up on what was missed before following it.
+
+Changes are read FEATURE_WORKER_BATCH at a time and processed on
+FEATURE_WORKER_CONCURRENCY threads. The next batch is only read once the current
+one is done, so a slow worker never holds more than one batch in memory; the
+server keeps the backlog. Reprocessing is idempotent: an issue whose
+`feature_store.source_signature` matches the stored one is skipped. Batches
+replayed after a crash therefore cost one read per issue.
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+import feature_store
+import mongo
+import scoring
+
+logging.basicConfig(level=logging.INFO)
+
+STATE_COLLECTION = 'feature_worker_state'
+BATCH_SIZE = int(os.environ.get("FEATURE_WORKER_BATCH", "64"))
+CONCURRENCY = int(os.environ.get("FEATURE_WORKER_CONCURRENCY", "4"))
+POLL_INTERVAL = float(os.environ.get("FEATURE_WORKER_POLL_SECONDS", "5"))
+# How long the change stream waits for events before a partial batch is processed
+MAX_AWAIT_MS = 1000
+ATTEMPTS = 3
+
+# Server error codes: change streams need a replica set; the resume token fell off the oplog
+_NO_CHANGE_STREAMS = (40573, 136)
+_HISTORY_LOST = 286
+
+
+def _update_reverse_matches(features, issue, matches):
+    """
+    Keeps other issues' stored matches in step with `issue`: it leaves every list
+    it was in, then joins the lists of its current matches (scores are symmetric).
+    """
+    issue_id = issue['_id']
+    features.update_many({"matches.id": issue_id}, {"$pull": {"matches": {"id": issue_id}}})
+    ops = []
+    for match in matches:
+        entry = {**match, "id": issue_id, "title": issue.get('title', '')}
+        ops.append(UpdateOne(
+            # Only lists that already exist; an issue without one gets it computed on its own turn
+            {"_id": match['id'], "matches_sig": {"$exists": True}},
+            {"$push": {"matches": {"$each": [entry], "$sort": {"score": -1}, "$slice": scoring.TOP_K}}},
+        ))
+    if ops:
+        features.bulk_write(ops, ordered=False)
+
+
+def process_issue(mongo_uri, db_name, issue_id):
+    """Brings one issue's stored features and matches up to date. Returns "skipped", "updated" or "removed"."""
+    import detect_duplicates_logic
+
+    db = mongo.get_database(mongo_uri, db_name)
+    features = feature_store.get_features_collection(db)
+    issue = db['issues'].find_one({"_id": issue_id}, feature_store.SOURCE_FIELDS)
+    stored = features.find_one({"_id": issue_id}, {"matches_sig": 1, "image_digest": 1}) or {}
+
+    if issue is None or issue.get('status') == "Rejected":
+        if stored.get('matches_sig') is None and issue is not None:
+            return "skipped"
+        detect_duplicates_logic.sync_issue(mongo_uri, issue_id, db_name, refresh_image=False)
+        features.update_one({"_id": issue_id}, {"$unset": {"matches": "", "matches_sig": ""}})
+        features.update_many({"matches.id": issue_id}, {"$pull": {"matches": {"id": issue_id}}})
+        return "removed"
+
+    sig = feature_store.source_signature(issue, detect_duplicates_logic.MODEL_NAME)
+    if stored.get('matches_sig') == sig:
+        return "skipped"
+
+    digest = feature_store.image_digest(issue)
+    # Embedding (if the text changed), pHash (if the image changed) and both indexes
+    detect_duplicates_logic.sync_issue(mongo_uri, issue_id, db_name, refresh_image=stored.get('image_digest') != digest)
+    result = detect_duplicates_logic.detect_duplicates(mongo_uri, issue_id, "/app", db_name)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    matches = result["matches"]
+    features.update_one({"_id": issue_id}, {"$set": {
+        "matches": matches,
+        "matches_sig": sig,
+        "image_digest": digest,
+        "matches_at": datetime.now(timezone.utc),
+    }}, upsert=True)
+    _update_reverse_matches(features, issue, matches)
+    return "updated"
+
+
+def _process_batch(mongo_uri, db_name, issue_ids, executor):
+    def work(issue_id):
+        for attempt in range(1, ATTEMPTS + 1):
+            try:
+                return process_issue(mongo_uri, db_name, issue_id)
+            except Exception as e:
+                if attempt == ATTEMPTS:
+                    # Not retried forever, or one bad issue would stall the whole stream
+                    logging.error(f"Giving up on {issue_id}: {e}")
+                    return "failed"
+                time.sleep(0.5 * attempt)
+
+    # The same issue edited several times in one batch is processed once
+    outcomes = list(executor.map(work, dict.fromkeys(issue_ids)))
+    counts = {o: outcomes.count(o) for o in set(outcomes)}
+    logging.info(f"Processed {len(outcomes)} issues: {counts}")
+    return counts
+
+
+def _load_state(db):
+    return db[STATE_COLLECTION].find_one({"_id": "issues"}) or {}
+
+
+def _save_state(db, **fields):
+    db[STATE_COLLECTION].update_one({"_id": "issues"}, {"$set": {**fields, "saved_at": datetime.now(timezone.utc)}}, upsert=True)
+
+
+def tail_changes(mongo_uri, db_name, stop, executor, catch_up=False):
+    """
+    Processes change-stream events until `stop` is set. With `catch_up` the saved resume
+    token is ignored: a new stream is opened first, then everything changed since the
+    poll watermarks is processed, so nothing written in between is missed.
+    """
+    db = mongo.get_database(mongo_uri, db_name)
+    state = {} if catch_up else _load_state(db)
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+    with db['issues'].watch(pipeline, resume_after=state.get('resume_token'), max_await_time_ms=MAX_AWAIT_MS) as stream:
+        logging.info("Following the issues change stream" + (" from the saved token." if state.get('resume_token') else "."))
+        token = state.get('resume_token')
+        if catch_up:
+            # Changes made during the poll are also delivered by the stream; reprocessing is idempotent.
+            # Its token is saved only after the poll, so a crash here catches up again
+            poll_once(mongo_uri, db_name, executor)
+        while not stop.is_set():
+            ids = []
+            while len(ids) < BATCH_SIZE:
+                change = stream.try_next()
+                if change is None:
+                    break
+                ids.append(change["documentKey"]["_id"])
+            if ids:
+                _process_batch(mongo_uri, db_name, ids, executor)
+            # Saved only after the batch is done: a crash replays it, which is idempotent
+            if stream.resume_token is not None and stream.resume_token != token:
+                token = stream.resume_token
+                _save_state(db, resume_token=token)
+
+
+def _keyset_query(field, mark):
+    if not mark:
+        return {field: {"$exists": True}}
+    value, last_id = mark
+    return {"$or": [{field: {"$gt": value}}, {field: value, "_id": {"$gt": last_id}}]}
+
+
+def poll_once(mongo_uri, db_name, executor):
+    """One polling pass over everything changed since the saved watermarks. Returns the number of issues seen."""
+    db = mongo.get_database(mongo_uri, db_name)
+    issues = db['issues']
+    seen = 0
+    # Issues saved through Mongoose carry updated_at; older ones only submitted_at
+    for field, scope in (("updated_at", {}), ("submitted_at", {"updated_at": {"$exists": False}})):
+        while True:
+            mark = _load_state(db).get(field)
+            query = {**scope, **_keyset_query(field, mark)}
+            rows = list(issues.find(query, {field: 1}).sort([(field, 1), ("_id", 1)]).limit(BATCH_SIZE))
+            if not rows:
+                break
+            _process_batch(mongo_uri, db_name, [row['_id'] for row in rows], executor)
+            _save_state(db, **{field: [rows[-1][field], rows[-1]['_id']]})
+            seen += len(rows)
+            if len(rows) < BATCH_SIZE:
+                break
+    return seen
+
+
+def poll_changes(mongo_uri, db_name, stop, executor):
+    logging.info(f"Polling issues every {POLL_INTERVAL}s.")
+    while not stop.is_set():
+        if not poll_once(mongo_uri, db_name, executor):
+            stop.wait(POLL_INTERVAL)
+
+
+def run(mongo_uri, db_name=None, mode="auto", stop=None):
+    stop = stop or threading.Event()
+    db = mongo.get_database(mongo_uri, db_name)
+    feature_store.get_features_collection(db).create_index("matches.id")
+    import detect_duplicates_logic
+    # Built up front: until then every issue would be scored against the whole collection
+    detect_duplicates_logic.prepare_indexes(mongo_uri, db_name, wait=True)
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        catch_up = False
+        while mode != "poll":
+            try:
+                return tail_changes(mongo_uri, db_name, stop, executor, catch_up)
+            except OperationFailure as e:
+                if e.code == _HISTORY_LOST and mode == "auto":
+                    # Down for longer than the oplog window: follow a new stream, catching up by polling
+                    logging.warning("Saved resume token is no longer in the oplog; catching up by polling.")
+                    catch_up = True
+                    continue
+                if e.code not in _NO_CHANGE_STREAMS or mode == "stream":
+                    raise
+                logging.warning(f"Change streams unavailable ({e}); falling back to polling.")
+                break
+        poll_changes(mongo_uri, db_name, stop, executor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGODB_URI"), required="MONGODB_URI" not in os.environ)
+    parser.add_argument("--db", help="Database name (default: the one in the URI)")
+    parser.add_argument("--mode", choices=("auto", "stream", "poll"), default="auto")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    # Finish the current batch (and save its checkpoint) on shutdown
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    run(args.mongo_uri, args.db, args.mode, stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Blocking stage for duplicate detection: picks the issues worth scoring before any
+text or image comparison runs.
+
+Two reports of the same pothole are filed a few hundred metres apart, under the
+same category, within weeks of each other. Candidates are therefore fetched with
+an indexed bounding-box query on (category, location_lat, location_lng) and
+trimmed to a great-circle radius around the target. The radius starts small and
+is widened step by step (DUPLICATE_RADII_KM) only while fewer than
+DUPLICATE_MIN_CANDIDATES issues come back. If the widest radius still yields
+fewer, the caller adds the global search's candidates to them.
+
+Issues without coordinates cannot be blocked this way; for those targets
+`select_candidates` returns None and the caller falls back to the global search.
+The bounding box ignores the antimeridian, which no Indian city is near.
+"""
+import logging
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+# Radii tried in order; an empty list disables blocking
+RADII_KM = [float(r) for r in os.environ.get("DUPLICATE_RADII_KM", "0.5,1,2,5").split(",") if r.strip()]
+# Stop widening once this many candidates are in range
+MIN_CANDIDATES = int(os.environ.get("DUPLICATE_MIN_CANDIDATES", "30"))
+SAME_CATEGORY = os.environ.get("DUPLICATE_SAME_CATEGORY", "true").lower() != "false"
+# Only issues submitted within this many days of the target; 0 means any time
+WINDOW_DAYS = float(os.environ.get("DUPLICATE_WINDOW_DAYS", "180"))
+
+# Fields the target needs for blocking (added to its projection)
+BLOCKING_FIELDS = {"category": 1, "location_lat": 1, "location_lng": 1, "submitted_at": 1}
+# Same key order as the IssueSchema index in src/db/models/Issue.ts, so both create the same index
+INDEXES = (
+    [("category", 1), ("location_lat", 1), ("location_lng", 1)],
+    [("location_lat", 1), ("location_lng", 1)],
+)
+
+_indexed = set()
+_indexed_lock = threading.Lock()
+
+
+def ensure_indexes(collection):
+    """Creates the blocking indexes once per collection and process (a no-op if they exist)."""
+    key = (collection.database.name, collection.name)
+    with _indexed_lock:
+        if key in _indexed:
+            return
+        _indexed.add(key)
+    for keys in INDEXES:
+        try:
+            collection.create_index(keys)
+        except Exception as e:
+            # Blocking still works unindexed, just slower
+            logging.warning(f"Could not create blocking index {keys}: {e}")
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Great-circle distances in km from (lat, lng) to each of the arrays `lats`, `lngs`."""
+    lat, lng = math.radians(lat), math.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) enclosing the circle of `radius_km` around (lat, lng)."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    # Longitude degrees shrink with latitude; clamp near the poles
+    dlng = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 1e-6)))
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+def has_location(doc):
+    lat, lng = doc.get("location_lat"), doc.get("location_lng")
+    return isinstance(lat, (int, float)) and isinstance(lng, (int, float))
+
+
+def blocking_query(target, radius_km, same_category=SAME_CATEGORY, window_days=WINDOW_DAYS):
+    """Mongo filter for non-rejected issues in the bounding box of `radius_km` around `target`."""
+    min_lat, max_lat, min_lng, max_lng = bounding_box(target["location_lat"], target["location_lng"], radius_km)
+    query = {
+        "_id": {"$ne": target["_id"]},
+        "status": {"$ne": "Rejected"},
+        "location_lat": {"$gte": min_lat, "$lte": max_lat},
+        "location_lng": {"$gte": min_lng, "$lte": max_lng},
+    }
+    if same_category and target.get("category"):
+        query["category"] = target["category"]
+    submitted = target.get("submitted_at")
+    if window_days and isinstance(submitted, datetime):
+        window = timedelta(days=window_days)
+        query["submitted_at"] = {"$gte": submitted - window, "$lte": submitted + window}
+    return query
+
+
+def select_candidates(collection, target, radii=None, min_candidates=MIN_CANDIDATES,
+                      same_category=SAME_CATEGORY, window_days=WINDOW_DAYS):
+    """
+    Returns (candidate ids, radius used in km), nearest first, or None when the
+    target has no coordinates or blocking is disabled.
+    """
+    radii = RADII_KM if radii is None else radii
+    if not radii or not has_location(target):
+        return None
+    ensure_indexes(collection)
+
+    for radius in radii:
+        query = blocking_query(target, radius, same_category, window_days)
+        rows = [row for row in collection.find(query, {"location_lat": 1, "location_lng": 1}) if has_location(row)]
+        ids = []
+        if rows:
+            dist = haversine_km(
+                target["location_lat"], target["location_lng"],
+                np.array([row["location_lat"] for row in rows], dtype=np.float64),
+                np.array([row["location_lng"] for row in rows], dtype=np.float64),
+            )
+            # The box's corners lie outside the circle
+            order = [i for i in np.argsort(dist, kind="stable") if dist[i] <= radius]
+            ids = [rows[i]["_id"] for i in order]
+        if len(ids) >= min_candidates:
+            break
+    return ids, radius
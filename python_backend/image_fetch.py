@@ -0,0 +1,90 @@
+"""
+Bounded, concurrent retrieval of remote issue images.
+
+All downloads share one pooled `requests.Session` (keep-alive) and a fixed-size
+thread pool. Every fetch has connect/read timeouts, a byte cap and an overall
+deadline; a slow or failing host yields None so callers fall back to text-only
+scoring instead of blocking the request.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from PIL import ImageFile
+from requests.adapters import HTTPAdapter
+
+FETCH_CONCURRENCY = int(os.environ.get("IMAGE_FETCH_CONCURRENCY", "8"))
+CONNECT_TIMEOUT = float(os.environ.get("IMAGE_FETCH_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.environ.get("IMAGE_FETCH_READ_TIMEOUT", "5"))
+TOTAL_DEADLINE = float(os.environ.get("IMAGE_FETCH_DEADLINE", "10"))
+MAX_IMAGE_BYTES = int(os.environ.get("IMAGE_FETCH_MAX_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=FETCH_CONCURRENCY, pool_maxsize=FETCH_CONCURRENCY, max_retries=0)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+_executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="image-fetch")
+
+
+def fetch_image(url, deadline=None):
+    """
+    Downloads and decodes `url` into a PIL image, or returns None.
+    Decoding is incremental: each chunk is fed to the decoder as it arrives.
+    """
+    deadline = deadline or time.monotonic() + TOTAL_DEADLINE
+    try:
+        with _session.get(url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+            if response.status_code != 200:
+                return None
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > MAX_IMAGE_BYTES:
+                logging.warning(f"Image too large ({length} bytes): {url[:80]}")
+                return None
+            parser = ImageFile.Parser()
+            received = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                received += len(chunk)
+                if received > MAX_IMAGE_BYTES or time.monotonic() > deadline:
+                    logging.warning(f"Image fetch aborted after {received} bytes: {url[:80]}")
+                    return None
+                parser.feed(chunk)
+            return parser.close()
+    except Exception as e:
+        logging.warning(f"Image fetch failed for {url[:80]}: {e}")
+        return None
+
+
+def fetch_all(urls, process=None, deadline=None):
+    """
+    Fetches `urls` concurrently (at most FETCH_CONCURRENCY in flight) and returns
+    {url: process(image)} with None for anything missing, failed or late.
+    `process` runs in the worker thread, so decoding/hashing overlaps other downloads.
+    """
+    urls = list(dict.fromkeys(urls))
+    out = dict.fromkeys(urls)
+    if not urls:
+        return out
+    deadline = deadline or TOTAL_DEADLINE
+    end = time.monotonic() + deadline
+
+    def job(url):
+        img = fetch_image(url, end)
+        if img is None:
+            return None
+        return process(img) if process else img
+
+    futures = {_executor.submit(job, url): url for url in urls}
+    done, pending = wait(futures, timeout=deadline)
+    for future in pending:
+        future.cancel()
+    if pending:
+        logging.warning(f"{len(pending)} of {len(urls)} images missed the {deadline}s deadline.")
+    for future in done:
+        try:
+            out[futures[future]] = future.result()
+        except Exception as e:
+            logging.warning(f"Image processing failed: {e}")
+    return out
@@ -0,0 +1,124 @@
+"""
+Shared ingestion stage for uploaded photos: header check, reduced decode, per-task resize.
+
+Phone photos arrive at 12+ megapixels while YOLO looks at 640 px and EasyOCR caps
+its canvas at 2560 px. `ingest()` reads the image header first (rejecting
+decompression bombs before any pixels are allocated), decodes JPEGs at 1/2, 1/4
+or 1/8 scale when that still covers the largest requested target, and returns
+one view per task, each no larger than that task's long-side target (views that
+are only cropped from keep the decoded resolution).
+"""
+import io
+import os
+import warnings
+
+# Long-side pixel targets per task; 0 keeps the decoded resolution
+TARGETS = {
+    # EasyOCR's default canvas_size: it would downscale anything larger itself
+    "ocr": int(os.environ.get("INGEST_OCR_MAX_SIDE", "2560")),
+    # YOLO letterboxes to imgsz=640 anyway
+    "yolo": int(os.environ.get("INGEST_YOLO_MAX_SIDE", "640")),
+    # Plate crops are cut from this view, so small plates keep their detail
+    "plate": int(os.environ.get("INGEST_PLATE_MAX_SIDE", "2560")),
+}
+# Views that are only cropped from, never fed to a model whole. They keep the decoded
+# resolution; their target only decides how far a JPEG may be reduced while decoding
+CROP_TASKS = {"plate"}
+# Images declaring more pixels than this are rejected before decoding. 50 MP covers the
+# full-resolution modes of phone cameras; a 50 MP BGR decode is 150 MB
+MAX_PIXELS = int(os.environ.get("INGEST_MAX_PIXELS", str(50_000_000)))
+HEADER_BYTES = 64 * 1024
+# cv2 and PIL are imported inside the functions: app imports this module for
+# ImageRejected and must stay within its startup import budget
+
+
+class ImageRejected(ValueError):
+    """The image is too large to decode safely."""
+
+
+class Ingested:
+    """Per-task views of one image, plus its original size for mapping coordinates back."""
+
+    def __init__(self, width, height, views):
+        self.width = width
+        self.height = height
+        self.views = views
+
+    def scale(self, task):
+        """Multiply coordinates in the `task` view by this to get original-image coordinates."""
+        return self.width / self.views[task].shape[1]
+
+
+def read_header(buf):
+    """(format, width, height) from the image header, or None if it is not a readable image."""
+    from PIL import Image
+
+    with warnings.catch_warnings():
+        # PIL warns about (and past 2x its limit, refuses) large images; MAX_PIXELS decides here
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        for data in (bytes(memoryview(buf)[:HEADER_BYTES]), buf):
+            try:
+                with Image.open(io.BytesIO(data)) as img:
+                    return img.format, img.width, img.height
+            except Image.DecompressionBombError:
+                raise ImageRejected("Image dimensions exceed the decode limit")
+            except Exception:
+                if len(data) >= len(buf):
+                    return None
+                # e.g. a large EXIF block pushes the JPEG frame header past the prefix
+
+
+def _decode(buf, fmt, long_side, target):
+    import cv2
+    import numpy as np
+
+    arr = np.frombuffer(buf, np.uint8)
+    if fmt == "JPEG" and target:
+        # libjpeg scales during IDCT: far less work and memory than decoding at full size
+        reduced = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+        for factor, flag in reduced:
+            if long_side // factor >= target:
+                return cv2.imdecode(arr, flag)
+    return cv2.imdecode(arr, cv2.IMREAD_COLOR)
+
+
+def _fit(img, target):
+    import cv2
+
+    h, w = img.shape[:2]
+    if not target or max(h, w) <= target:
+        return img
+    f = target / max(h, w)
+    # INTER_AREA avoids aliasing on big reductions but is ~7x slower; under 2x, linear is as good
+    interpolation = cv2.INTER_AREA if f < 0.5 else cv2.INTER_LINEAR
+    return cv2.resize(img, (max(1, round(w * f)), max(1, round(h * f))), interpolation=interpolation)
+
+
+def ingest(buf, tasks):
+    """
+    Decodes `buf` once into a view per task in `tasks` (keys of TARGETS).
+    Returns None for undecodable data; raises ImageRejected for decompression bombs.
+    """
+    header = read_header(buf)
+    if header is None:
+        return None
+    fmt, width, height = header
+    if width * height > MAX_PIXELS:
+        raise ImageRejected(f"Image is {width}x{height}, over the {MAX_PIXELS} pixel limit")
+
+    targets = [TARGETS[t] for t in tasks]
+    # Decode only as much as the most demanding task needs (0 = full resolution)
+    largest = 0 if 0 in targets else max(targets)
+    img = _decode(buf, fmt, max(width, height), largest)
+    if img is None:
+        return None
+
+    # Original size as displayed: cv2 applies EXIF rotation, so swap if it turned the image
+    if (img.shape[1] > img.shape[0]) != (width > height) and width != height:
+        width, height = height, width
+    # Largest view first; each smaller one is resized from the previous, not from the full decode
+    views = {}
+    source = img
+    for task in sorted(tasks, key=lambda t: TARGETS[t] or float("inf"), reverse=True):
+        views[task] = source = source if task in CROP_TASKS else _fit(source, TARGETS[task])
+    return Ingested(width, height, views)
@@ -0,0 +1,79 @@
+"""
+Dedicated executors for blocking model inference.
+
+Each model type gets its own thread pool with a fixed number of workers and a
+bounded number of waiting jobs, so a slow OCR call can never block the asyncio
+event loop (and with it the health check). When a pool is full the request is
+rejected immediately with `CapacityError`, which the app turns into a 503 with
+a Retry-After header instead of letting work pile up.
+
+Threads rather than processes: torch, OpenCV and ONNX kernels release the GIL,
+and a process pool would load a private copy of every model per worker.
+"""
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CapacityError(Exception):
+    def __init__(self, pool, retry_after):
+        super().__init__(f"{pool} inference queue is full")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    def __init__(self, name, workers, max_queue, retry_after=2):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-inference")
+        # Running + waiting jobs; a slot is freed when the job finishes, even if the client went away
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise CapacityError(self.name, self.retry_after)
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {"workers": self.workers, "max_queue": self.max_queue, "in_flight": self.in_flight}
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, str(default)))
+
+
+POOLS = {
+    "ocr": InferencePool("ocr", _env_int("OCR_WORKERS", 1), _env_int("OCR_MAX_QUEUE", 4)),
+    # Several workers so concurrent frames can meet in the YOLO micro-batcher (forward passes stay serialized)
+    "yolo": InferencePool("yolo", _env_int("YOLO_WORKERS", 4), _env_int("YOLO_MAX_QUEUE", 8)),
+    "text": InferencePool("text", _env_int("TEXT_WORKERS", 4), _env_int("TEXT_MAX_QUEUE", 16)),
+}
+
+
+async def run(pool, fn, *args, **kwargs):
+    """Runs `fn(*args, **kwargs)` on the named pool; raises CapacityError when it is saturated."""
+    return await POOLS[pool].run(fn, *args, **kwargs)
+
+
+def stats():
+    return {name: pool.stats() for name, pool in POOLS.items()}
@@ -0,0 +1,116 @@
+"""
+In-process BM25 inverted index over issue title + description.
+
+Duplicate reports often share exact place, street or landmark names ("pothole
+near Shivaji Chowk, FC Road") that a sentence embedding blurs together with
+every other pothole. The index keeps one postings dict per token and scores
+queries with Okapi BM25. Adds and removes are incremental, like the vector
+indexes in ann_index.py.
+
+detect_duplicates combines it with the vector index according to DUPLICATE_LEXICAL:
+- hybrid (default): the ANN and BM25 rankings are fused with reciprocal rank
+  fusion (RRF), and the top DUPLICATE_CANDIDATE_POOL go to exact rescoring.
+- prefilter: only the BM25 candidates are rescored (the ANN is used when no
+  token matches).
+- off: vector candidates only.
+"""
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+MODE = os.environ.get("DUPLICATE_LEXICAL", "hybrid")  # "hybrid", "prefilter" or "off"
+# BM25 candidates fused with (or, in prefilter mode, instead of) the ANN candidates
+LEXICAL_POOL = int(os.environ.get("DUPLICATE_LEXICAL_POOL", "100"))
+K1 = 1.2
+B = 0.75
+# Standard RRF damping constant: ranks past the first few count about equally
+RRF_K = 60
+# Tokens in more than this share of issues ("road", "issue") carry no signal and would
+# make a query walk most of the index
+MAX_DF_RATIO = 0.25
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its near of on or the there this to very was "
+    "were with please not no our my we i".split()
+)
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall((text or "").lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, k1=K1, b=B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = {}  # token -> {issue id: term frequency}
+        self._docs = {}  # issue id -> Counter of its tokens (needed to remove it again)
+        self._lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, issue_id):
+        return issue_id in self._docs
+
+    def add(self, issue_id, text):
+        """Inserts or replaces the text of `issue_id`."""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            if issue_id in self._docs:
+                self._remove(issue_id)
+            self._docs[issue_id] = terms
+            length = sum(terms.values())
+            self._lengths[issue_id] = length
+            self._total_length += length
+            for token, tf in terms.items():
+                self._postings.setdefault(token, {})[issue_id] = tf
+
+    def remove(self, issue_id):
+        with self._lock:
+            if issue_id in self._docs:
+                self._remove(issue_id)
+
+    def _remove(self, issue_id):
+        for token in self._docs.pop(issue_id):
+            postings = self._postings[token]
+            del postings[issue_id]
+            if not postings:
+                del self._postings[token]
+        self._total_length -= self._lengths.pop(issue_id)
+
+    def search(self, text, k=10, exclude=None):
+        """Returns up to `k` (issue_id, BM25 score) pairs, best first."""
+        query = set(tokenize(text))
+        with self._lock:
+            n = len(self._docs)
+            if not n or not query:
+                return []
+            avg_length = self._total_length / n
+            scores = {}
+            for token in query:
+                postings = self._postings.get(token)
+                if not postings or (n > 20 and len(postings) > MAX_DF_RATIO * n):
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for issue_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[issue_id] / avg_length)
+                    scores[issue_id] = scores.get(issue_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        scores.pop(exclude, None)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def rrf(rankings, k=RRF_K):
+    """Reciprocal rank fusion of several best-first id lists into one best-first id list."""
+    fused = {}
+    for ranking in rankings:
+        for rank, issue_id in enumerate(ranking):
+            fused[issue_id] = fused.get(issue_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=lambda issue_id: -fused[issue_id])
@@ -0,0 +1,303 @@
+"""
+Single owner of the heavy models (EasyOCR, YOLO, sentence-transformer).
+
+Every module asks the registry for a model instead of building its own, so each
+model is loaded exactly once per process. `warm_up()` loads independent models in
+parallel at startup and runs one dummy inference on each; `status()` backs the
+`/ready` endpoint.
+
+EasyOCR readers and ultralytics predictors keep per-call state and are not safe
+to call from several threads at once, so inference goes through `use(name)`,
+which serializes calls on those models while sharing a single instance.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+PROCESS_START = time.monotonic()
+
+YOLO_MODEL_PATH = os.environ.get("YOLO_MODEL_PATH", "best.pt")
+YOLO_BACKEND = os.environ.get("YOLO_BACKEND", "auto")  # "auto" (exported if present) or "pytorch"
+SENTENCE_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Where EasyOCR keeps its detector/recognizer weights
+OCR_MODEL_DIR = os.path.join(os.environ.get("EASYOCR_MODULE_PATH", os.path.expanduser("~/.EasyOCR")), "model")
+# Comma-separated models to load at startup; empty disables warm-up
+WARMUP_MODELS = [m for m in os.environ.get("WARMUP_MODELS", "ocr,yolo,sentence").split(",") if m]
+# A failed load is retried on first use after this many seconds, doubling per failure up to the max
+RETRY_SECONDS = float(os.environ.get("MODEL_RETRY_SECONDS", "10"))
+RETRY_MAX_SECONDS = float(os.environ.get("MODEL_RETRY_MAX_SECONDS", "300"))
+
+
+def _load_ocr():
+    import easyocr
+    return easyocr.Reader(['en'], gpu=False)
+
+
+def _warm_ocr(reader):
+    import numpy as np
+    reader.readtext(np.full((64, 256, 3), 255, dtype=np.uint8), detail=0)
+
+
+def yolo_model_path():
+    """
+    Prefers a CPU-optimized export of YOLO_MODEL_PATH when one sits next to it
+    (see ml/scripts/export_helmet_model.py); YOLO_BACKEND=pytorch forces the .pt file.
+    """
+    if YOLO_BACKEND == "pytorch":
+        return YOLO_MODEL_PATH
+    stem = os.path.splitext(YOLO_MODEL_PATH)[0]
+    for candidate in (f"{stem}_int8_openvino_model", f"{stem}_openvino_model", f"{stem}.onnx"):
+        if os.path.exists(candidate):
+            return candidate
+    return YOLO_MODEL_PATH
+
+
+def _load_yolo():
+    from ultralytics import YOLO
+    path = yolo_model_path()
+    logging.info(f"Loading YOLO model from {path}")
+    return YOLO(path, task='detect')
+
+
+def _fixed_batch(path):
+    """
+    The batch size an exported model is fixed to, or None if it takes any batch (or is
+    a .pt file). Exports made with dynamic=False accept exactly their export batch.
+    """
+    try:
+        if os.path.isdir(path):
+            import yaml
+            with open(os.path.join(path, "metadata.yaml")) as f:
+                meta = yaml.safe_load(f) or {}
+            if (meta.get("args") or {}).get("dynamic"):
+                return None
+            return int(meta.get("batch", 1))
+        if path.endswith(".onnx"):
+            import onnxruntime
+            dim = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"]).get_inputs()[0].shape[0]
+            return dim if isinstance(dim, int) else None
+    except Exception as e:
+        logging.warning(f"Could not read the batch size of {path}, assuming 1: {e}")
+        return 1
+    return None
+
+
+_yolo_fixed_batch = {}
+
+
+def yolo_fixed_batch():
+    """Fixed batch size of the YOLO weights in use, or None if any batch works."""
+    path = yolo_model_path()
+    if path not in _yolo_fixed_batch:
+        _yolo_fixed_batch[path] = _fixed_batch(path)
+    return _yolo_fixed_batch[path]
+
+
+def _warm_yolo(model):
+    import numpy as np
+    model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+
+def _load_sentence():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(SENTENCE_MODEL_NAME)
+
+
+def _warm_sentence(model):
+    model.encode(["warm up"])
+
+
+def _weights_path(name):
+    if name == "ocr":
+        return OCR_MODEL_DIR
+    if name == "yolo":
+        return yolo_model_path()
+    return SENTENCE_MODEL_NAME
+
+
+def _fingerprint(name):
+    """Short hash of the weights' path, size and mtime (every file, for exported model directories)."""
+    path = _weights_path(name)
+    parts = [name, path]
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for f in sorted(files):
+                st = os.stat(os.path.join(root, f))
+                parts.append(f"{f}:{st.st_size}:{st.st_mtime_ns}")
+    elif os.path.exists(path):
+        st = os.stat(path)
+        parts.append(f"{st.st_size}:{st.st_mtime_ns}")
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+def _torch_modules(name, instance):
+    if name == "ocr":
+        return [instance.detector, instance.recognizer]
+    if name == "yolo":
+        return [instance.model]
+    return [instance]
+
+
+def _weights_mb(name, instance):
+    """Parameter + buffer bytes of the model's torch modules (what each copy costs in RSS)."""
+    total = 0
+    try:
+        for module in _torch_modules(name, instance):
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                total += tensor.numel() * tensor.element_size()
+    except Exception:
+        # Exported/non-torch backends: no cheap way to size them
+        return None
+    return round(total / (1024 * 1024), 1)
+
+
+def rss_mb():
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class _Entry:
+    def __init__(self, name, load, warm, exclusive):
+        self.name = name
+        self.load = load
+        self.warm = warm
+        self.lock = threading.Lock()
+        # Serializes inference on models that are not thread-safe
+        self.infer_lock = threading.Lock() if exclusive else None
+        self.weights_mb = None
+        self.version = None  # fingerprint of the weights the loaded instance came from
+        self.instance = None
+        self.state = "not_loaded"  # not_loaded -> loading -> ready | failed (-> loading again after retry_at)
+        self.error = None
+        self.failures = 0
+        self.retry_at = None  # time.monotonic() after which a failed load is tried again
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.ready_at = None  # seconds since process start
+
+    def status(self):
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "ready_after_start_seconds": self.ready_at,
+            "weights_mb": self.weights_mb,
+            "version": self.version,
+            "error": self.error,
+            "failures": self.failures,
+            "retry_in_seconds": max(0.0, round(self.retry_at - time.monotonic(), 1)) if self.state == "failed" else None,
+        }
+
+    def can_load(self):
+        return self.state != "failed" or time.monotonic() >= self.retry_at
+
+
+_entries = {
+    "ocr": _Entry("ocr", _load_ocr, _warm_ocr, exclusive=True),
+    "yolo": _Entry("yolo", _load_yolo, _warm_yolo, exclusive=True),
+    # Only ever called from the encoder's single batching thread
+    "sentence": _Entry("sentence", _load_sentence, _warm_sentence, exclusive=False),
+}
+
+
+def get(name, warm=False):
+    """
+    Returns the shared instance of model `name`, loading it on first use. Returns None
+    while a failed load is backing off; the first call after the backoff tries again.
+    """
+    entry = _entries[name]
+    if entry.instance is not None:
+        return entry.instance
+    if not entry.can_load():
+        return None
+    with entry.lock:
+        if entry.instance is None and entry.can_load():
+            entry.state = "loading"
+            start = time.monotonic()
+            try:
+                entry.version = _fingerprint(name)
+                instance = entry.load()
+                entry.load_seconds = round(time.monotonic() - start, 3)
+                entry.weights_mb = _weights_mb(name, instance)
+                if warm:
+                    start = time.monotonic()
+                    with entry.infer_lock or nullcontext():
+                        entry.warm(instance)
+                    entry.warmup_seconds = round(time.monotonic() - start, 3)
+                entry.instance = instance
+                entry.state = "ready"
+                entry.error = None
+                entry.failures = 0
+                entry.ready_at = round(time.monotonic() - PROCESS_START, 3)
+                logging.info(f"Model '{name}' ready in {entry.load_seconds}s (warm-up {entry.warmup_seconds}s).")
+            except Exception as e:
+                entry.state = "failed"
+                entry.error = str(e)
+                entry.failures += 1
+                # The weights may be replaced before the retry; fingerprint them again then
+                entry.version = None
+                backoff = min(RETRY_SECONDS * 2 ** (entry.failures - 1), RETRY_MAX_SECONDS)
+                entry.retry_at = time.monotonic() + backoff
+                logging.error(f"Failed to load model '{name}' (attempt {entry.failures}, retrying in {backoff:g}s): {e}")
+    return entry.instance
+
+
+def version(name):
+    """
+    Identifies the weights behind model `name`: those of the loaded instance, or of
+    the files on disk if it is not loaded yet. Changes whenever the weights change.
+    """
+    return _entries[name].version or _fingerprint(name)
+
+
+@contextmanager
+def use(name):
+    """
+    Yields the shared model `name` (None if it failed to load) for one inference call,
+    holding its inference lock if the model is not thread-safe.
+    """
+    instance = get(name)
+    entry = _entries[name]
+    with entry.infer_lock or nullcontext():
+        yield instance
+
+
+def warm_up(names=None):
+    """Loads and warms the given models in parallel; blocks until all are done."""
+    names = [n for n in (names or WARMUP_MODELS) if n in _entries]
+    if not names:
+        return
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="warm-up") as pool:
+        list(pool.map(lambda n: get(n, warm=True), names))
+
+
+def warm_up_in_background(names=None):
+    thread = threading.Thread(target=warm_up, args=(names,), name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def status():
+    models = {name: entry.status() for name, entry in _entries.items()}
+    models["yolo"]["path"] = yolo_model_path()
+    expected = [n for n in WARMUP_MODELS if n in _entries]
+    # Readiness probes keep polling, so a warm-up model that failed is retried here once its backoff ends
+    due = [n for n in expected if _entries[n].state == "failed" and _entries[n].can_load()]
+    if due:
+        warm_up_in_background(due)
+    return {
+        "ready": all(_entries[n].state == "ready" for n in expected),
+        "uptime_seconds": round(time.monotonic() - PROCESS_START, 3),
+        "rss_mb": rss_mb(),
+        "models": models,
+    }
@@ -0,0 +1,62 @@
+"""
+Process-wide MongoDB access.
+
+One MongoClient (and its connection pool) is kept per connection URI and reused
+by every request, instead of opening a new client per call.
+"""
+import os
+import threading
+from itertools import islice
+
+from pymongo import MongoClient
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+# Documents per round trip when streaming through large collections
+CURSOR_BATCH_SIZE = int(os.environ.get("MONGO_BATCH_SIZE", "500"))
+
+_clients = {}
+_databases = {}
+_lock = threading.Lock()
+
+
+def get_client(mongo_uri):
+    with _lock:
+        client = _clients.get(mongo_uri)
+        if client is None:
+            client = MongoClient(
+                mongo_uri,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+            )
+            _clients[mongo_uri] = client
+        return client
+
+
+def get_database(mongo_uri, db_name=None):
+    """Cached database handle keyed by (uri, database name)."""
+    key = (mongo_uri, db_name or "")
+    db = _databases.get(key)
+    if db is None:
+        client = get_client(mongo_uri)
+        db = client.get_database(db_name) if db_name else client.get_database()
+        _databases[key] = db
+    return db
+
+
+def iter_batches(cursor, size=CURSOR_BATCH_SIZE):
+    """Yields lists of at most `size` documents from `cursor`, fetching `size` per round trip."""
+    cursor = cursor.batch_size(size)
+    while True:
+        batch = list(islice(cursor, size))
+        if not batch:
+            return
+        yield batch
+
+
+def close_all():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _databases.clear()
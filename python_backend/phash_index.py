@@ -0,0 +1,94 @@
+"""
+Hamming-distance index over 256-bit perceptual hashes (multi-index hashing).
+
+Each hash is split into 16 chunks of 16 bits, and every chunk value keys its own
+table. If two hashes differ in at most r bits, then by pigeonhole at least one
+chunk differs in at most r // 16 bits. A radius-30 query therefore only looks up
+each chunk and its 16 one-bit neighbours (16 * 17 lookups), then verifies the
+few colliding hashes exactly, instead of comparing against every stored hash.
+"""
+import threading
+from collections import defaultdict
+
+HASH_BITS = 256
+CHUNKS = 16
+CHUNK_BITS = HASH_BITS // CHUNKS
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _chunks(value):
+    return [(value >> (i * CHUNK_BITS)) & _CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _neighbours(key, radius):
+    """All chunk values within `radius` bits of `key` (radius is 0-2 in practice)."""
+    out = [key]
+    frontier = [(key, -1)]
+    for _ in range(radius):
+        nxt = []
+        for value, last in frontier:
+            for bit in range(last + 1, CHUNK_BITS):
+                flipped = value ^ (1 << bit)
+                out.append(flipped)
+                nxt.append((flipped, bit))
+        frontier = nxt
+    return out
+
+
+class MultiIndexHash:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tables = [defaultdict(set) for _ in range(CHUNKS)]
+        self._hash_of = {}  # issue id -> hash
+
+    def __len__(self):
+        return len(self._hash_of)
+
+    def __contains__(self, issue_id):
+        return issue_id in self._hash_of
+
+    def add(self, issue_id, value):
+        """Inserts or replaces the hash for `issue_id`. A None hash removes it."""
+        with self._lock:
+            if issue_id in self._hash_of:
+                self._remove(issue_id)
+            if value is None:
+                return
+            self._hash_of[issue_id] = value
+            for table, key in zip(self._tables, _chunks(value)):
+                table[key].add(issue_id)
+
+    def remove(self, issue_id):
+        with self._lock:
+            if issue_id in self._hash_of:
+                self._remove(issue_id)
+
+    def _remove(self, issue_id):
+        value = self._hash_of.pop(issue_id)
+        for table, key in zip(self._tables, _chunks(value)):
+            bucket = table[key]
+            bucket.discard(issue_id)
+            if not bucket:
+                del table[key]
+
+    def search(self, value, radius):
+        """Returns [(issue_id, distance)] for all hashes within `radius` bits, closest first."""
+        chunk_radius = radius // CHUNKS
+        seen = set()
+        out = []
+        with self._lock:
+            for table, key in zip(self._tables, _chunks(value)):
+                for probe in _neighbours(key, chunk_radius):
+                    for issue_id in table.get(probe, ()):
+                        if issue_id in seen:
+                            continue
+                        seen.add(issue_id)
+                        d = hamming(value, self._hash_of[issue_id])
+                        if d <= radius:
+                            out.append((issue_id, d))
+        out.sort(key=lambda x: x[1])
+        return out
@@ -0,0 +1,177 @@
+"""
+Content-addressed cache for idempotent inference results.
+
+Keys are a SHA-256 over the decoded image bytes, the version of every model the
+result depends on (see `model_registry.version`) and any request parameters such
+as the voter ID, so new weights simply stop matching old entries. Results are
+held as JSON in an in-memory LRU bounded by total size, with an optional on-disk
+tier (RESULT_CACHE_DIR) that survives restarts.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import model_registry
+
+MAX_MEMORY_BYTES = int(float(os.environ.get("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+# Unset disables the disk tier
+CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")
+MAX_DISK_BYTES = int(float(os.environ.get("RESULT_CACHE_DISK_MAX_MB", "512")) * 1024 * 1024)
+
+
+class ResultCache:
+    def __init__(self, name, max_bytes=MAX_MEMORY_BYTES, disk_dir=CACHE_DIR, max_disk_bytes=MAX_DISK_BYTES):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> JSON bytes, least recently used first
+        self._bytes = 0
+        self._disk_bytes = None  # measured on first disk write
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, models, *parts):
+        """Cache key for a result of `models` (names in model_registry) over `parts` (bytes-like or str)."""
+        h = hashlib.sha256()
+        for name in models:
+            h.update(f"{name}={model_registry.version(name)};".encode())
+        for part in parts:
+            part = part if isinstance(part, (bytes, bytearray, memoryview)) else str(part).encode()
+            # Length-prefixed so no two part lists hash the same byte stream
+            h.update(len(part).to_bytes(8, "big"))
+            h.update(part)
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns a fresh copy of the cached result, or None."""
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(blob)
+        blob = self._read_disk(key)
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, blob)
+        return json.loads(blob)
+
+    def put(self, key, result):
+        blob = json.dumps(result).encode()
+        with self._lock:
+            self._insert(key, blob)
+        self._write_disk(key, blob)
+
+    def _insert(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = blob
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"Result cache read failed: {e}")
+            return None
+
+    def _write_disk(self, key, blob):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)  # readers never see a partial file
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+                else:
+                    self._disk_bytes += len(blob)
+                over = self._disk_bytes > self.max_disk_bytes
+            if over:
+                self._prune_disk()
+        except OSError as e:
+            # The disk tier is best effort; the in-memory entry is already stored
+            logging.warning(f"Result cache write failed: {e}")
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for f in files:
+                if f.endswith(".json"):
+                    path = os.path.join(root, f)
+                    st = os.stat(path)
+                    yield st.st_mtime, st.st_size, path
+
+    def _prune_disk(self):
+        # Oldest first, down to 90% of the cap so pruning does not run on every write
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+                "disk": self.disk_dir,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name):
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = ResultCache(name)
+        return _caches[name]
+
+
+def stats():
+    with _caches_lock:
+        return {name: cache.stats() for name, cache in _caches.items()}
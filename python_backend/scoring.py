@@ -0,0 +1,54 @@
+import numpy as np
+
+# Weighting used by duplicate detection (kept identical to the original per-candidate loop)
+IMAGE_OVERRIDE = 0.95
+TEXT_OVERRIDE = 0.90
+TEXT_WEIGHT = 0.6
+IMAGE_WEIGHT = 0.4
+SCORE_CUTOFF = 0.55
+TOP_K = 10
+
+
+def normalize_rows(matrix):
+    """Contiguous float32 copy of `matrix` with unit-length rows (zero rows stay zero)."""
+    m = np.ascontiguousarray(matrix, dtype=np.float32)
+    if m.ndim == 1:
+        m = m.reshape(1, -1)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def text_scores(target_vec, candidate_matrix):
+    """
+    Cosine similarity of the target against every row, clipped at 0 like `compare_vectors`.
+    `candidate_matrix` must already be row-normalized.
+    """
+    target = normalize_rows(target_vec)[0]
+    scores = candidate_matrix @ target
+    return np.maximum(scores, 0.0)
+
+
+def combine_scores(score_text, score_image):
+    return np.where(
+        score_image >= IMAGE_OVERRIDE,
+        score_image,
+        np.where(score_text >= TEXT_OVERRIDE, score_text, score_text * TEXT_WEIGHT + score_image * IMAGE_WEIGHT)
+    )
+
+
+def top_k(final_scores, k=TOP_K, cutoff=SCORE_CUTOFF):
+    """
+    Indices of the best `k` scores above `cutoff`, best first.
+    Uses a partial selection instead of sorting every candidate. Ties on the displayed
+    (rounded) score keep scan order, which is what the old stable list sort produced.
+    """
+    idx = np.flatnonzero(final_scores > cutoff)
+    if len(idx) == 0:
+        return idx
+    shown = np.round(final_scores * 100, 1)
+    if len(idx) > k:
+        best = idx[np.argpartition(-final_scores[idx], k - 1)[:k]]
+        idx = idx[shown[idx] >= shown[best].min()]
+    order = np.lexsort((idx, -shown[idx]))
+    return idx[order][:k]
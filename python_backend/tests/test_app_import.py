@@ -0,0 +1,34 @@
+"""`import app` must stay light: model libraries load on first use, not at startup."""
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "easyocr", "ultralytics", "sentence_transformers")
+BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", "1000"))
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed_ms, "heavy": sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)}}))
+"""
+
+
+def _import_app():
+    # A fresh interpreter, so nothing imported by pytest or other tests counts
+    proc = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, cwd=BACKEND_DIR, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_app_import_skips_model_libraries():
+    assert _import_app()["heavy"] == []
+
+
+def test_app_import_within_budget():
+    # Best of three: the first run also pays for cold bytecode and file caches
+    ms = min(_import_app()["ms"] for _ in range(3))
+    assert ms <= BUDGET_MS, f"import app took {ms:.0f} ms (budget {BUDGET_MS:.0f} ms)"
@@ -0,0 +1,61 @@
+"""Candidate selection of /detect-duplicates when geo blocking finds too few nearby issues."""
+import hashlib
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import detect_duplicates_logic  # noqa: E402
+import geo_blocking  # noqa: E402
+import mongo  # noqa: E402
+
+URI = "mongodb://duplicate-candidates"
+DB_NAME = "duplicate_candidates"
+
+
+def _fake_encode(texts):
+    # Deterministic stand-in for MiniLM: identical texts get identical vectors
+    rows = []
+    for text in texts:
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        rows.append(np.random.default_rng(seed).standard_normal(384).astype(np.float32))
+    return np.array(rows)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock.MongoClient(URI)
+    monkeypatch.setattr(mongo, "MongoClient", lambda *args, **kwargs: client)
+    monkeypatch.setattr(mongo, "_clients", {})
+    monkeypatch.setattr(mongo, "_databases", {})
+    monkeypatch.setattr(detect_duplicates_logic, "encode_texts", _fake_encode)
+    monkeypatch.setattr(detect_duplicates_logic.ann_index, "INDEX_KIND", "flat")
+    monkeypatch.setattr(geo_blocking, "_indexed", set())
+    yield client[DB_NAME]
+    client.drop_database(DB_NAME)
+
+
+def _issue(issue_id, title, lat=None, lng=None):
+    doc = {"_id": issue_id, "title": title, "description": "reported by residents", "status": "Pending",
+           "category": "Roads", "submitted_at": datetime(2026, 1, 1)}
+    if lat is not None:
+        doc.update(location_lat=lat, location_lng=lng)
+    return doc
+
+
+def test_sparse_area_adds_global_candidates(db):
+    # Two unrelated neighbours (fewer than MIN_CANDIDATES) and a copy of the report far away
+    db.issues.insert_many([
+        _issue("TARGET", "deep pothole near the bus stand", 18.52, 73.85),
+        _issue("NEAR-1", "overflowing garbage bin", 18.5201, 73.8501),
+        _issue("NEAR-2", "broken footpath tiles", 18.5202, 73.8502),
+        _issue("FAR", "deep pothole near the bus stand", 19.07, 72.87),
+    ])
+    assert len(geo_blocking.select_candidates(db.issues, db.issues.find_one({"_id": "TARGET"}))[0]) == 2
+    detect_duplicates_logic.prepare_indexes(URI, DB_NAME, wait=True)
+
+    result = detect_duplicates_logic.detect_duplicates(URI, "TARGET", "/app", DB_NAME)
+
+    assert [match["id"] for match in result["matches"]][:1] == ["FAR"]
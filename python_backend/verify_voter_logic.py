@@ -1,35 +1,136 @@
-import easyocr
+import os
 import re
 import logging
-import numpy as np
-import cv2
 
-# Initialize reader once (Global)
-# In a module, this runs on import. In FastAPI app, we might control this better, but this is fine.
-reader = easyocr.Reader(['en'], gpu=False)
+import image_ingest
+import model_registry
 
-def extract_text_from_bytes(image_bytes):
+# "regions": read only the deskewed card's header/EPIC/address regions, falling back
+# to full-page OCR unless that clearly verifies the card; "full": always full page
+OCR_MODE = os.environ.get("VOTER_OCR_MODE", "regions")
+# EasyOCR confidence a region text needs to count towards a region-only match
+REGION_MIN_CONFIDENCE = float(os.environ.get("VOTER_REGION_MIN_CONFIDENCE", "0.5"))
+
+
+def cache_settings():
+    """The settings that can change a verification result, for the result cache key."""
+    return f"mode={OCR_MODE};min_conf={REGION_MIN_CONFIDENCE};ocr_side={image_ingest.TARGETS['ocr']}"
+
+
+def _ingest(image_bytes):
+    # Decoded (reduced for large JPEGs) and resized to EasyOCR's canvas size in one step
     if not image_bytes:
+        return None
+    try:
+        return image_ingest.ingest(image_bytes, ("ocr",))
+    except image_ingest.ImageRejected:
+        raise
+    except Exception as e:
+        logging.error(f"Error decoding image: {e}")
+        return None
+
+def _read_full_page(frame):
+    # Raises when the reader cannot be loaded or fails, so callers can tell that apart from a blank card
+    if frame is None:
         return []
+    # EasyOCR reads directly from numpy array; the reader is shared with plate reading
+    with model_registry.use("ocr") as reader:
+        return reader.readtext(frame.views["ocr"], detail=0)
+
+def extract_text_from_bytes(image_bytes):
     try:
-        # Convert bytes to numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # EasyOCR reads directly from numpy array
-        result = reader.readtext(img, detail=0)
-        return result
+        return _read_full_page(_ingest(image_bytes))
     except Exception as e:
         logging.error(f"Error reading text: {e}")
         return []
 
+def _confident(texts):
+    """Distinct texts of (text, confidence) pairs at or above REGION_MIN_CONFIDENCE, in order."""
+    return list(dict.fromkeys(text for text, conf in texts if text and conf >= REGION_MIN_CONFIDENCE))
+
+def _read_front(card):
+    """
+    Texts of the front's header/EPIC region. The region is one crop, and its line bands
+    are recognized directly in one call, without EasyOCR's text detector.
+    """
+    import voter_card
+
+    crop = voter_card.crop_regions(card, {"front": voter_card.FRONT_REGION})["front"]
+    boxes = voter_card.line_boxes(voter_card.FRONT_REGION, voter_card.FRONT_LINE_HEIGHT)
+    with model_registry.use("ocr") as reader:
+        lines = reader.recognize(crop, horizontal_list=boxes, free_list=[], detail=1)
+    return _confident((text, conf) for _, text, conf in lines)
+
+def _read_back(card):
+    """Texts of the back's address block; its layout varies, so it keeps text detection."""
+    import voter_card
+
+    crop = voter_card.crop_regions(card, voter_card.BACK_REGIONS)["address"]
+    with model_registry.use("ocr") as reader:
+        return _confident((text, conf) for _, text, conf in reader.readtext(crop, detail=1))
+
+def _verify_regions(front, back, voter_id_input):
+    """
+    Region-only verification, or None when it is not conclusive. Only a match on texts
+    read with at least REGION_MIN_CONFIDENCE is returned; every reject is re-checked on the
+    full page, so region mode can never turn away a card that full-page OCR accepts.
+    """
+    import voter_card
+
+    front_card = voter_card.find_card(front.views["ocr"])
+    back_card = voter_card.find_card(back.views["ocr"]) if back is not None else None
+    if front_card is None or (back is not None and back_card is None):
+        return None
+    if back_card is not None and voter_card.looks_identical(front_card, back_card):
+        # Same photo twice: let the full-page path report the duplicate
+        return None
+
+    try:
+        front_text = _read_front(front_card)
+        # No ID on the front: this goes to the full page anyway, so the back is not read
+        if not _verify_texts(front_text, [], voter_id_input, False)["match"]:
+            return None
+        back_text = _read_back(back_card) if back_card is not None else []
+    except Exception as e:
+        logging.error(f"Region OCR failed: {e}")
+        return None
+
+    result = _verify_texts(front_text, back_text, voter_id_input, back is not None)
+    if not result["match"]:
+        return None
+    result["ocr_mode"] = "regions"
+    return result
+
 def verify_voter_card_memory(front_bytes, back_bytes, voter_id_input):
+    front = _ingest(front_bytes)
+    back = _ingest(back_bytes) if back_bytes else None
+
+    if OCR_MODE == "regions" and front is not None and (back is not None or not back_bytes):
+        result = _verify_regions(front, back, voter_id_input)
+        if result is not None:
+            return result
+
     # 1. Extract Text
-    front_text = extract_text_from_bytes(front_bytes)
-    back_text = []
-    if back_bytes:
-         back_text = extract_text_from_bytes(back_bytes)
-    
+    try:
+        front_text = _read_full_page(front)
+        back_text = []
+        if back_bytes:
+             back_text = _read_full_page(back)
+    except Exception as e:
+        logging.error(f"Error reading text: {e}")
+        # The "error" key keeps this outcome out of the result cache
+        return {
+            "match": False,
+            "reason": "Text recognition is unavailable, please try again.",
+            "extracted_text": [],
+            "error": str(e),
+        }
+
+    result = _verify_texts(front_text, back_text, voter_id_input, bool(back_bytes))
+    result["ocr_mode"] = "full_page"
+    return result
+
+def _verify_texts(front_text, back_text, voter_id_input, has_back):
     all_text = " ".join(front_text + back_text).upper()
     voter_id_input = voter_id_input.upper().strip()
     
@@ -48,7 +149,7 @@ def verify_voter_card_memory(front_bytes, back_bytes, voter_id_input):
     is_valid = False
     reason = ""
     
-    if back_bytes:
+    if has_back:
          if front_text == back_text and len(front_text) > 0:
              return {
                  "match": False,
@@ -57,7 +158,7 @@ def verify_voter_card_memory(front_bytes, back_bytes, voter_id_input):
              }
 
     if id_match:
-        if back_bytes and back_score < 1:
+        if has_back and back_score < 1:
              is_valid = False
              reason = "Voter ID number matches, but back side appears invalid."
         else:
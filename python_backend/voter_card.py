@@ -0,0 +1,116 @@
+"""
+Voter-card (EPIC) geometry: find the card in a photo, deskew it to a fixed
+landscape size and cut out the layout regions worth reading.
+
+Region boxes are (x0, y0, x1, y1) fractions of the deskewed card. They follow the
+ECI card layout: the header band with "ELECTION COMMISSION OF INDIA / IDENTITY
+CARD", the EPIC number just below it, and the address block on the back.
+"""
+import cv2
+import numpy as np
+
+# ID-1 card, 85.6 x 54 mm
+CARD_SIZE = (1000, 631)
+# Accepted long/short side ratio of a detected quad (perspective skews it)
+ASPECT_RANGE = (1.3, 1.9)
+# ...and of a photo taken as already cropped to the card (excludes 4:3 and 16:9 frames)
+CROPPED_ASPECT_RANGE = (1.45, 1.72)
+# The card must cover at least this share of the photo
+MIN_CARD_AREA = 0.2
+DETECT_SIDE = 800
+
+# Header band and EPIC-number line, read as one crop
+FRONT_REGION = (0.0, 0.0, 1.0, 0.42)
+# Line bands within it, one text line tall at half-line steps, so every line of the region
+# lies whole inside one band. Each band goes straight to the recognizer (no text detection).
+FRONT_LINE_HEIGHT = 0.12
+BACK_REGIONS = {
+    "address": (0.0, 0.04, 1.0, 0.82),
+}
+
+
+def _order_corners(pts):
+    """Top-left, top-right, bottom-right, bottom-left."""
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype=np.float32)
+
+
+def _aspect_ok(w, h, aspect_range=ASPECT_RANGE):
+    long_side, short_side = max(w, h), min(w, h)
+    return short_side > 0 and aspect_range[0] <= long_side / short_side <= aspect_range[1]
+
+
+def _warp(img, corners):
+    tl, tr, br, bl = corners
+    width = (np.linalg.norm(tr - tl) + np.linalg.norm(br - bl)) / 2
+    height = (np.linalg.norm(bl - tl) + np.linalg.norm(br - tr)) / 2
+    if height > width:
+        # Card photographed in portrait: rotate the corner order so the long side runs left-right
+        corners = np.array([bl, tl, tr, br], dtype=np.float32)
+    target = np.array([[0, 0], [CARD_SIZE[0] - 1, 0], [CARD_SIZE[0] - 1, CARD_SIZE[1] - 1], [0, CARD_SIZE[1] - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(img, matrix, CARD_SIZE, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def find_card(img):
+    """
+    The card deskewed to CARD_SIZE, or None if no card-shaped quad covers enough
+    of the photo. A photo already cropped to the card is used whole.
+    """
+    h, w = img.shape[:2]
+    scale = min(1.0, DETECT_SIDE / max(h, w))
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else gray
+
+    edges = cv2.Canny(cv2.GaussianBlur(small, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = MIN_CARD_AREA * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) != 4:
+            continue
+        corners = _order_corners(approx.reshape(4, 2).astype(np.float32) / scale)
+        _, _, cw, ch = cv2.boundingRect(approx)
+        if _aspect_ok(cw, ch):
+            return _warp(img, corners)
+
+    if _aspect_ok(w, h, CROPPED_ASPECT_RANGE):
+        # No card edge inside the photo: it is most likely cropped to the card already
+        card = img if w >= h else cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+        return cv2.resize(card, CARD_SIZE, interpolation=cv2.INTER_AREA)
+    return None
+
+
+def crop_regions(card, regions):
+    """{name: crop} of a deskewed card for the given fractional region boxes."""
+    cw, ch = CARD_SIZE
+    return {
+        name: card[round(y0 * ch):round(y1 * ch), round(x0 * cw):round(x1 * cw)]
+        for name, (x0, y0, x1, y1) in regions.items()
+    }
+
+
+def line_boxes(region, line_height):
+    """
+    EasyOCR `horizontal_list` boxes ([x0, x1, y0, y1] in pixels of the region's crop) for
+    bands `line_height` tall, at half-line steps, covering a fractional region of the card.
+    """
+    cw, ch = CARD_SIZE
+    x0, y0, x1, y1 = region
+    width, height = round((x1 - x0) * cw), round((y1 - y0) * ch)
+    band, step = round(line_height * ch), max(1, round(line_height * ch / 2))
+    tops = list(range(0, max(height - band, 0) + 1, step))
+    if tops[-1] + band < height:
+        tops.append(height - band)
+    return [[0, width, top, min(top + band, height)] for top in tops]
+
+
+def looks_identical(card_a, card_b, threshold=12.0):
+    """True when two deskewed cards are the same photo (mean absolute difference of thumbnails)."""
+    a = cv2.resize(cv2.cvtColor(card_a, cv2.COLOR_BGR2GRAY), (64, 40), interpolation=cv2.INTER_AREA)
+    b = cv2.resize(cv2.cvtColor(card_b, cv2.COLOR_BGR2GRAY), (64, 40), interpolation=cv2.INTER_AREA)
+    return float(np.mean(cv2.absdiff(a, b))) < threshold
@@ -51,7 +51,7 @@ export async function verifyVoterIdAction(input: VerifyVoterIdInput) {
     }
 }
 
-export async function detectDuplicatesAction(issueId: string) {
+export async function detectDuplicatesAction(issueId: string, refresh = false) {
     const pythonApiUrl = (process.env.PYTHON_API_URL || "").replace(/\/$/, "");
     if (!pythonApiUrl) {
         console.warn("[AI] PYTHON_API_URL not set. Skipping duplicate detection.");
@@ -68,7 +68,8 @@ export async function detectDuplicatesAction(issueId: string) {
             body: JSON.stringify({
                 issueId: issueId,
                 mongoUri: mongoUri,
-                dbName: dbName
+                dbName: dbName,
+                refresh: refresh // true recomputes instead of reading the precomputed matches
             })
         });
 
@@ -89,3 +90,22 @@ export async function detectDuplicatesAction(issueId: string) {
     }
 }
 
+export async function syncIssueIndexAction(issueId: string) {
+    // Keeps the Python duplicate index in step with issue creates, edits and status changes
+    const pythonApiUrl = (process.env.PYTHON_API_URL || "").replace(/\/$/, "");
+    if (!pythonApiUrl) return;
+
+    try {
+        await fetch(`${pythonApiUrl}/index-issue`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                issueId: issueId,
+                mongoUri: process.env.MONGODB_URI || "",
+                dbName: process.env.MONGODB_DB_NAME || ""
+            })
+        });
+    } catch (error) {
+        console.error("Error syncing duplicate index:", error);
+    }
+}
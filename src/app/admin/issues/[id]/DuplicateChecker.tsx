@@ -23,10 +23,10 @@ export function DuplicateChecker({ issueId }: { issueId: string }) {
     const [matches, setMatches] = useState<DuplicateMatch[] | null>(null);
     const [error, setError] = useState<string | null>(null);
 
-    const runCheck = () => {
+    const runCheck = (refresh = false) => {
         setError(null);
         startTransition(async () => {
-            const result = await detectDuplicatesAction(issueId);
+            const result = await detectDuplicatesAction(issueId, refresh);
             if (result.error) {
                 setError(result.error);
                 setMatches(null);
@@ -38,7 +38,7 @@ export function DuplicateChecker({ issueId }: { issueId: string }) {
 
     if (matches === null && !isPending && !error) {
         return (
-            <Button onClick={runCheck} variant="outline" className="w-full gap-2 border-dashed">
+            <Button onClick={() => runCheck()} variant="outline" className="w-full gap-2 border-dashed">
                 <Copy className="w-4 h-4" /> Run AI Duplicate Check
             </Button>
         );
@@ -54,7 +54,7 @@ export function DuplicateChecker({ issueId }: { issueId: string }) {
                     {isPending ? (
                         <Loader2 className="w-4 h-4 animate-spin text-muted-foreground" />
                     ) : (
-                        <Button size="sm" variant="ghost" onClick={runCheck} className="h-6 text-xs text-muted-foreground">
+                        <Button size="sm" variant="ghost" onClick={() => runCheck(true)} className="h-6 text-xs text-muted-foreground">
                             Re-run
                         </Button>
                     )}
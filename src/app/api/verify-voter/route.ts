@@ -4,6 +4,7 @@ import path from 'path';
 import { writeFile, unlink } from 'fs/promises';
 import { exec } from 'child_process';
 import util from 'util';
+import { persistentWorkersEnabled, runPythonJob } from '@/lib/python-worker';
 
 const execAsync = util.promisify(exec);
 
@@ -46,6 +47,21 @@ export async function POST(req: Request) {
         const pythonPath = path.join(projectRoot, "python", "venv", "Scripts", "python.exe");
         const scriptPath = path.join(projectRoot, "ml", "scripts", "verify_voter.py");
 
+        if (persistentWorkersEnabled()) {
+            try {
+                // Same arguments as the one-shot call: front back id
+                const result = await runPythonJob(pythonPath, scriptPath, [tempFilePath, tempFilePathBack || "NONE", voterId]);
+
+                await unlink(tempFilePath).catch(console.error);
+                if (tempFilePathBack) await unlink(tempFilePathBack).catch(console.error);
+
+                return NextResponse.json(result);
+            } catch (workerError: any) {
+                // Worker could not start or crashed: fall back to a one-shot process
+                console.error("Persistent Python worker failed, executing once:", workerError);
+            }
+        }
+
         console.log(`Executing: ${pythonPath} ${scriptPath} ${tempFilePath} "${voterId}"`);
 
         try {
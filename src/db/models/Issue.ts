@@ -14,10 +14,12 @@ export interface IIssue extends Omit<Document, '_id'> {
     image_hint?: string;
     submitted_by: string; // Ref to User._id
     submitted_at: Date;
+    updated_at?: Date; // Maintained by Mongoose on every save/update
     upvotes: number;
     is_urgent: number; // 0 or 1 to match SQLite boolean logic, or we can switch to Boolean
     license_plate?: string;
     violation_type?: string;
+    duplicate_cluster?: string; // Smallest issue _id of its duplicate group (python_backend/duplicate_clusters.py)
 }
 
 const IssueSchema = new Schema<IIssue>({
@@ -37,7 +39,16 @@ const IssueSchema = new Schema<IIssue>({
     is_urgent: { type: Number, default: 0 },
     license_plate: { type: String },
     violation_type: { type: String },
-}, { _id: false });
+    duplicate_cluster: { type: String },
+}, { _id: false, timestamps: { createdAt: false, updatedAt: 'updated_at' } });
+
+// Duplicate-detection blocking: nearby issues of one category (see python_backend/geo_blocking.py)
+IssueSchema.index({ category: 1, location_lat: 1, location_lng: 1 });
+IssueSchema.index({ location_lat: 1, location_lng: 1 });
+IssueSchema.index({ duplicate_cluster: 1 }, { sparse: true });
+// Polling fallback of the duplicate feature worker (python_backend/feature_worker.py)
+IssueSchema.index({ updated_at: 1, _id: 1 });
+IssueSchema.index({ submitted_at: 1, _id: 1 });
 
 export const Issue = mongoose.models.Issue || mongoose.model<IIssue>('Issue', IssueSchema);
 
@@ -0,0 +1,116 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import readline from 'readline';
+
+// Long-lived `python <script> --serve` processes (see ml/scripts/job_server.py).
+// Models are loaded once per worker instead of once per request; jobs are
+// newline-delimited JSON and several can be in flight at the same time.
+
+const JOB_TIMEOUT_MS = Number(process.env.ML_WORKER_TIMEOUT_MS || 120_000);
+
+// Set ML_PERSISTENT_WORKERS=false to go back to one process per request
+export function persistentWorkersEnabled() {
+    return process.env.ML_PERSISTENT_WORKERS !== 'false';
+}
+
+type PendingJob = {
+    resolve: (result: any) => void;
+    reject: (error: Error) => void;
+    timer: NodeJS.Timeout;
+};
+
+class PythonWorker {
+    private proc: ChildProcessWithoutNullStreams | null = null;
+    private ready: Promise<void> | null = null;
+    private pending = new Map<number, PendingJob>();
+    private nextId = 1;
+
+    constructor(private pythonExecutable: string, private script: string) { }
+
+    private start(): Promise<void> {
+        const proc = spawn(this.pythonExecutable, [this.script, '--serve'], { cwd: process.cwd() });
+        this.proc = proc;
+
+        this.ready = new Promise((resolve, reject) => {
+            const lines = readline.createInterface({ input: proc.stdout });
+            lines.on('line', (line) => {
+                let message: any;
+                try {
+                    message = JSON.parse(line);
+                } catch (e) {
+                    console.warn('Ignoring non-JSON worker output:', line);
+                    return;
+                }
+                if (message.ready) {
+                    resolve();
+                    return;
+                }
+                const job = this.pending.get(message.id);
+                if (job) {
+                    this.pending.delete(message.id);
+                    clearTimeout(job.timer);
+                    job.resolve(message.result);
+                }
+            });
+
+            proc.stderr.on('data', (data) => {
+                console.warn(`[${this.script}]`, data.toString().trimEnd());
+            });
+
+            const fail = (error: Error) => {
+                if (this.proc === proc) {
+                    this.proc = null;
+                    this.ready = null;
+                }
+                reject(error);
+                for (const [id, job] of this.pending) {
+                    clearTimeout(job.timer);
+                    job.reject(error);
+                    this.pending.delete(id);
+                }
+            };
+            proc.on('error', fail);
+            proc.on('exit', (code) => fail(new Error(`Python worker exited with code ${code}`)));
+        });
+        return this.ready;
+    }
+
+    async run(args: string[]): Promise<any> {
+        if (!this.proc || !this.ready) {
+            this.start();
+        }
+        const proc = this.proc!;
+        await this.ready;
+
+        const id = this.nextId++;
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(() => {
+                this.pending.delete(id);
+                reject(new Error(`Python worker job timed out after ${JOB_TIMEOUT_MS} ms`));
+            }, JOB_TIMEOUT_MS);
+            this.pending.set(id, { resolve, reject, timer });
+            proc.stdin.write(JSON.stringify({ id, args }) + '\n');
+        });
+    }
+}
+
+declare global {
+    var pythonWorkers: Map<string, PythonWorker> | undefined;
+}
+
+// Cached on globalThis so hot reloads in development reuse the running workers
+const workers = global.pythonWorkers ?? (global.pythonWorkers = new Map());
+
+/**
+ * Runs one job on the persistent worker for `script`, starting it on first use
+ * (and again after a crash). `args` are the script's one-shot CLI arguments;
+ * resolves with the JSON the script would have printed.
+ */
+export function runPythonJob(pythonExecutable: string, script: string, args: string[]): Promise<any> {
+    const key = `${pythonExecutable}\0${script}`;
+    let worker = workers.get(key);
+    if (!worker) {
+        worker = new PythonWorker(pythonExecutable, script);
+        workers.set(key, worker);
+    }
+    return worker.run(args);
+}
@@ -50,6 +50,7 @@ export type Issue = {
   isUrgent?: boolean;
   licensePlate?: string;
   violationType?: string;
+  duplicateCluster?: string; // Shared by every issue of one duplicate group
   resolutionEvidence?: ResolutionEvidence;
 };
 
@@ -6,7 +6,7 @@ import { z } from "zod";
 import { addIssue, incrementUpvote, updateIssueStatus, getUserById, getUserNotifications, deleteIssue } from "./data";
 import type { IssueStatus } from "@/lib/types";
 import { issueCategories } from "@/lib/types";
-import { detectDuplicatesAction } from "@/ai/actions";
+import { detectDuplicatesAction, syncIssueIndexAction } from "@/ai/actions";
 const issueSchema = z.object({
   title: z.string().min(5, "Title must be at least 5 characters long"),
   description: z.string().min(20, "Description must be at least 20 characters long"),
@@ -152,6 +152,9 @@ export async function createIssueAction(prevState: FormState, formData: FormData
       violationType: validatedFields.data.violationType
     }, userId);
 
+    // Add the new issue to the duplicate index; its embedding and pHash are stored and reused below
+    await syncIssueIndexAction(newIssue.id);
+
     // Run REAL duplicate detection via Python script (MongoDB based)
     let finalMessage = "Issue submitted successfully!";
     if (aiCategory !== validatedFields.data.category) {
@@ -204,6 +207,8 @@ export async function updateIssueStatusAction(issueId: string, newStatus: IssueS
       }
       // CHANGED: Do not delete issue on rejection. Keep it for records.
       await updateIssueStatus(issueId, newStatus, notes, txHash, user.id);
+      // Rejected issues leave the duplicate index (fire-and-forget)
+      syncIssueIndexAction(issueId);
       revalidatePath('/admin/dashboard');
       revalidatePath('/');
       revalidatePath('/issues');
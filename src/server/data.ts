@@ -80,6 +80,7 @@ async function mapIssue(doc: any): Promise<Issue> {
     isUrgent: Boolean(obj.is_urgent),
     licensePlate: obj.license_plate,
     violationType: obj.violation_type,
+    duplicateCluster: obj.duplicate_cluster,
     blockchainTransaction,
     resolutionEvidence
   };
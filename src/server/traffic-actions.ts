@@ -4,6 +4,7 @@ import { spawn } from 'child_process';
 import path from 'path';
 import fs from 'fs/promises';
 import { z } from 'zod';
+import { persistentWorkersEnabled, runPythonJob } from '@/lib/python-worker';
 
 // Define response schema
 const TrafficViolationSchema = z.object({
@@ -47,6 +48,25 @@ export async function detectTrafficViolationAction(formData: FormData): Promise<
         // Use local virtual environment python
         const pythonExecutable = path.join(process.cwd(), '.venv', 'Scripts', 'python.exe');
 
+        if (persistentWorkersEnabled()) {
+            try {
+                const jsonResult = await runPythonJob(pythonExecutable, pythonScript, [tempFilePath]);
+                try { await fs.unlink(tempFilePath); } catch (e) {
+                    console.error("Failed to delete temp file", e);
+                }
+                try {
+                    const parsed = TrafficViolationSchema.parse(jsonResult);
+                    return { success: true, data: parsed };
+                } catch (e) {
+                    console.error('Failed to parse Python output:', jsonResult, e);
+                    return { success: false, message: 'Invalid response from AI model.' };
+                }
+            } catch (e) {
+                // Worker could not start or crashed: fall back to a one-shot process
+                console.error('Persistent Python worker failed, spawning once:', e);
+            }
+        }
+
         return new Promise((resolve) => {
             const pythonProcess = spawn(pythonExecutable, [pythonScript, tempFilePath]);
 